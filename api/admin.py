@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from api.models import Holiday
+
+
+@admin.register(Holiday)
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ["date", "name", "collection"]
+    list_filter = ["collection"]
+    date_hierarchy = "date"
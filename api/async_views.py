@@ -0,0 +1,43 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.functional import classproperty
+
+
+class AsyncViewMixin:
+    """Serves a DRF view as a coroutine when settings.ASYNC_VIEWS is on, which
+    DRF 3.14 cannot do by itself. An async a<method> handler, e.g. aget, then
+    runs on the event loop once authentication and the permission checks are
+    done in a thread. Methods without one keep the regular DRF dispatch, run
+    in a thread as a whole. With ASYNC_VIEWS off, under WSGI, the view is the
+    plain sync view and the async handlers are unused"""
+
+    @classproperty
+    def view_is_async(cls):
+        return settings.ASYNC_VIEWS
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.view_is_async:
+            return super().dispatch(request, *args, **kwargs)
+        return self.adispatch(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        handler = getattr(self, f"a{method}", None)
+        if method not in self.http_method_names or handler is None:
+            return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+        # Mirrors APIView.dispatch
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
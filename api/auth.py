@@ -0,0 +1,92 @@
+import binascii
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+from rest_framework import exceptions
+
+
+def _settings():
+    return {"ENABLED": True, "TIMEOUT": 60 * 60, **getattr(settings, "AUTH_CACHE", {})}
+
+
+def _key(digest):
+    return f"auth_token:{digest}"
+
+
+def cache_token(auth_token):
+    """Remember a verified token until it expires, at most TIMEOUT seconds"""
+    config = _settings()
+    if not config["ENABLED"]:
+        return
+    timeout = config["TIMEOUT"]
+    if auth_token.expiry is not None:
+        timeout = min(timeout, (auth_token.expiry - timezone.now()).total_seconds())
+        if timeout <= 0:
+            return
+    cache.set(
+        _key(auth_token.digest),
+        (auth_token.user_id, auth_token.token_key, auth_token.expiry),
+        timeout,
+    )
+
+
+def revoke_token(digest):
+    cache.delete(_key(digest))
+
+
+# Covers logout, logout of every token, deleted users and the purge task
+@receiver(post_delete, sender=AuthToken)
+def revoke_deleted_token(sender, instance, **kwargs):
+    revoke_token(instance.digest)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Knox token authentication that keeps verified token digests in the
+    cache, so a known token costs a cache read and a user lookup by id
+    instead of the token scan by prefix and the expiry sweep of the user's
+    other tokens. Unknown tokens take the regular knox path"""
+
+    def authenticate_credentials(self, token):
+        if not _settings()["ENABLED"]:
+            return super().authenticate_credentials(token)
+        try:
+            digest = hash_token(token.decode("utf-8"))
+        except (TypeError, UnicodeDecodeError, binascii.Error):
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+
+        cached = cache.get(_key(digest))
+        if cached is None:
+            user, auth_token = super().authenticate_credentials(token)
+            cache_token(auth_token)
+            return user, auth_token
+
+        user_id, token_key, expiry = cached
+        # The cache entry can outlive the token when clocks drift
+        if expiry is not None and expiry < timezone.now():
+            revoke_token(digest)
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            revoke_token(digest)
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        # Stands in for the stored row, enough for logout to delete it
+        auth_token = AuthToken(
+            digest=digest, token_key=token_key, user=user, expiry=expiry
+        )
+        auth_token._state.adding = False
+        if knox_settings.AUTO_REFRESH and auth_token.expiry:
+            self.renew_token(auth_token)
+        return self.validate_user(auth_token)
+
+    def renew_token(self, auth_token):
+        super().renew_token(auth_token)
+        cache_token(auth_token)
@@ -0,0 +1,239 @@
+import datetime
+import json
+import random
+import re
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+
+from api.generation import generate_sessions
+from api.models import Collection, Session
+from api.timetable import create_grid
+
+USER_PREFIX = "benchmark_user_"
+PASSWORD = "benchmark-password-1"
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def seed(users, courses, periods=6, weeks=18, seed=0):
+    """Create users with a collection of courses spread over a semester that
+    is half over today, with about a fifth of the past sessions bunked.
+    Returns the number of sessions created"""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    start_date = today - datetime.timedelta(weeks=weeks // 2)
+    end_date = start_date + datetime.timedelta(weeks=weeks)
+    # Hashing is deliberately slow, every benchmark user shares one hash
+    password = make_password(PASSWORD)
+
+    existing = set(
+        User.objects.filter(username__startswith=USER_PREFIX).values_list(
+            "username", flat=True
+        )
+    )
+    created = User.objects.bulk_create(
+        User(username=f"{USER_PREFIX}{i}", password=password)
+        for i in range(users)
+        if f"{USER_PREFIX}{i}" not in existing
+    )
+    sessions = 0
+    for user in created:
+        with transaction.atomic():
+            collection = Collection.objects.create(
+                user=user, name="benchmark", start_date=start_date, end_date=end_date
+            )
+            names = [f"course_{i}" for i in range(courses)]
+            create_grid(
+                collection,
+                [[rng.choice(names) for _ in range(5)] for _ in range(periods)],
+            )
+            sessions += generate_sessions(collection.id, start_date, end_date)
+            past = Session.objects.filter(
+                course__collection=collection, date__lte=today
+            )
+            past.annotate(bucket=F("id") % 5).filter(bucket=0).update(status="bunked")
+    return sessions
+
+
+def clear():
+    """Delete every benchmark user along with their data"""
+    return User.objects.filter(username__startswith=USER_PREFIX).delete()[0]
+
+
+class Transport:
+    """Sends requests in process through the django test client, or over HTTP
+    when a base url is given, and returns (status, headers, body)"""
+
+    def __init__(self, url=None):
+        self.url = url and url.rstrip("/")
+        self.local = threading.local()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Token {token}"
+        body = json.dumps(data).encode() if data is not None else None
+        if self.url is None:
+            return self._client(method, path, body, headers)
+        request = urllib.request.Request(
+            self.url + path, data=body, headers=headers, method=method
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers, error.read()
+        except (urllib.error.URLError, ConnectionError) as error:
+            # Counted as an error rather than ending the run
+            return 599, {}, str(error).encode()
+
+    def _client(self, method, path, body, headers):
+        from django.test import Client
+
+        if not hasattr(self.local, "client"):
+            self.local.client = Client()
+        response = self.local.client.generic(
+            method,
+            path,
+            body or b"",
+            content_type=headers.pop("Content-Type"),
+            headers=headers,
+        )
+        content = b"".join(response) if response.streaming else response.content
+        return response.status_code, response.headers, content
+
+
+class Context:
+    """Per user state the scenarios draw from"""
+
+    def __init__(self, transport, users, seed=0):
+        self.transport = transport
+        self.rng = random.Random(seed)
+        self.users = []
+        for user in (
+            User.objects.filter(username__startswith=USER_PREFIX)
+            .select_related("collection")
+            .order_by("id")[:users]
+        ):
+            status, _, body = transport.request(
+                "POST", "/login", {"username": user.username, "password": PASSWORD}
+            )
+            if status >= 400:
+                raise RuntimeError(f"login of {user.username} failed with {status}")
+            self.users.append(
+                {
+                    "username": user.username,
+                    "token": json.loads(body)["token"],
+                    "sessions": list(
+                        Session.objects.filter(
+                            course__collection=user.collection
+                        ).values_list("id", "date")
+                    ),
+                }
+            )
+        if not self.users:
+            raise RuntimeError("No benchmark users, run seed_benchmark first")
+
+
+def login(ctx, rng, user):
+    return "POST", "/login", {"username": user["username"], "password": PASSWORD}, None
+
+
+def fetch_collection(ctx, rng, user):
+    return "GET", "/collection", None, user["token"]
+
+
+def datequery(ctx, rng, user):
+    _, date = rng.choice(user["sessions"])
+    return "GET", f"/datequery?date={date.isoformat()}", None, user["token"]
+
+
+def statquery(ctx, rng, user):
+    return "GET", "/statquery", None, user["token"]
+
+
+def mark_session(ctx, rng, user):
+    session_id, _ = rng.choice(user["sessions"])
+    status = rng.choice(["present", "bunked"])
+    return "PATCH", f"/session/{session_id}", {"status": status}, user["token"]
+
+
+def bulk_cancel(ctx, rng, user):
+    _, date = rng.choice(user["sessions"])
+    data = {"start_date": date.isoformat(), "end_date": date.isoformat()}
+    return "POST", "/bulk_cancel", data, user["token"]
+
+
+# Mirrors the bruno collection: Login, Fetch Collection, Fetch Sessions,
+# Fetch Statistics, Update Session and Bulk Cancel Sessions
+SCENARIOS = {
+    "login": login,
+    "fetch_collection": fetch_collection,
+    "datequery": datequery,
+    "statquery": statquery,
+    "mark_session": mark_session,
+    "bulk_cancel": bulk_cancel,
+}
+
+
+def _percentile(values, percent):
+    if len(values) < 2:
+        return values[0] if values else None
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def run(ctx, scenario, requests, concurrency, seed=0):
+    """Send requests of one scenario from concurrency threads, returns the
+    latency percentiles in ms, throughput and queries per request"""
+    build = SCENARIOS[scenario]
+    samples = []
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(f"{seed}:{scenario}:{index}")
+        count = requests // concurrency + (index < requests % concurrency)
+        for _ in range(count):
+            method, path, data, token = build(ctx, rng, rng.choice(ctx.users))
+            start = time.perf_counter()
+            status, headers, _ = ctx.transport.request(method, path, data, token)
+            elapsed = time.perf_counter() - start
+            queries = QUERIES.search(headers.get("Server-Timing") or "")
+            with lock:
+                samples.append(
+                    (
+                        elapsed,
+                        status,
+                        int(queries.group(1)) if queries else None,
+                        headers.get("X-Cache") == "HIT",
+                    )
+                )
+        # Threads of the in process transport hold their own connection
+        connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    queries = [sample[2] for sample in samples if sample[2] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(sample[1] >= 400 for sample in samples),
+        "throughput_rps": round(len(samples) / wall, 1),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "queries_mean": round(statistics.fmean(queries), 2) if queries else None,
+        "queries_max": max(queries, default=None),
+        "cache_hits": sum(sample[3] for sample in samples),
+    }
@@ -0,0 +1,145 @@
+import datetime
+import functools
+import hashlib
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+HITS_KEY = "response_cache:hits"
+MISSES_KEY = "response_cache:misses"
+
+
+def _settings():
+    return {"ENABLED": True, "TIMEOUT": 60 * 60, **getattr(settings, "RESPONSE_CACHE", {})}
+
+
+def _incr(key):
+    # incr raises on missing keys, add is a no-op on existing ones
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def _generation_key(user_id):
+    # A user owns at most one collection, so keying the collection generation
+    # by its owner lets reads find it without touching the database
+    return f"collection_generation:{user_id}"
+
+
+def get_generation(user_id):
+    return cache.get(_generation_key(user_id), 0)
+
+
+def bump_generation(user_id):
+    """Invalidate every cached response of the user's collection"""
+    if not _settings()["ENABLED"]:
+        return
+    _incr(_generation_key(user_id))
+
+
+def bump_collection_generation(collection_id):
+    from api.models import Collection
+
+    user_id = (
+        Collection.objects.filter(id=collection_id)
+        .values_list("user_id", flat=True)
+        .first()
+    )
+    if user_id is not None:
+        bump_generation(user_id)
+
+
+def get_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0,
+    }
+
+
+def _lookup(request, scope):
+    """The cache key of the request and the cached response, if any"""
+    # Generation is read before the database so a concurrent write
+    # can only ever leave a stale entry under an abandoned generation
+    generation = get_generation(request.user.id)
+    url = hashlib.sha1(request.build_absolute_uri().encode()).hexdigest()
+    key = (
+        f"response:{request.user.id}:{generation}:{scope}:"
+        f"{datetime.date.today().isoformat()}:{url}"
+    )
+
+    cached = cache.get(key)
+    if cached is not None:
+        _incr(HITS_KEY)
+        data, status = cached
+        return key, Response(data, status=status, headers={"X-Cache": "HIT"})
+    _incr(MISSES_KEY)
+    return key, None
+
+
+def _store(key, response, timeout):
+    if response.status_code == 200:
+        cache.set(key, (response.data, response.status_code), timeout=timeout)
+    response["X-Cache"] = "MISS"
+    return response
+
+
+def cache_response(scope, timeout=None):
+    """Cache the response data of a view method per user, dropped whenever
+    the user's collection generation is bumped. Async view methods do the
+    cache round trips in a thread"""
+
+    def decorator(method):
+        if iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                config = _settings()
+                if not config["ENABLED"] or not request.user.is_authenticated:
+                    return await method(self, request, *args, **kwargs)
+                key, response = await sync_to_async(_lookup)(request, scope)
+                if response is not None:
+                    return response
+                response = await method(self, request, *args, **kwargs)
+                return await sync_to_async(_store)(
+                    key, response, timeout or config["TIMEOUT"]
+                )
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            config = _settings()
+            if not config["ENABLED"] or not request.user.is_authenticated:
+                return method(self, request, *args, **kwargs)
+            key, response = _lookup(request, scope)
+            if response is not None:
+                return response
+            response = method(self, request, *args, **kwargs)
+            return _store(key, response, timeout or config["TIMEOUT"])
+
+        return wrapper
+
+    return decorator
+
+
+class InvalidateCacheMixin:
+    """Bumps the user's collection generation after any successful write"""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and request.user.is_authenticated
+        ):
+            bump_generation(request.user.id)
+        return response
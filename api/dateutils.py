@@ -1,76 +1,83 @@
 import datetime
-from datetime import timedelta
+from collections import OrderedDict
 
 SA = 5
 SU = 6
-HOLIDAYS = [
-    "2024-02-03",  # Non - Instructional WD (Saturday)
-    "2024-02-04",  # H (Sunday)
-    "2024-02-10",  # H (Saturday)
-    "2024-02-11",  # H (Sunday)
-    "2024-02-17",  # Instructional WD (Saturday)
-    "2024-02-18",  # H (Sunday)
-    "2024-02-24",  # H (Saturday)
-    "2024-02-25",  # H (Sunday)
-    "2024-03-02",  # Non - Instructional WD (Saturday)
-    "2024-03-03",  # H (Sunday)
-    "2024-03-09",  # H (Saturday)
-    "2024-03-10",  # H (Sunday)
-    "2024-03-16",  # Instructional WD (Saturday)
-    "2024-03-17",  # H (Sunday)
-    "2024-03-23",  # H (Saturday)
-    "2024-03-24",  # H (Sunday)
-    "2024-03-28",  # Maundy Thursday H
-    "2024-03-29",  # Good Friday H
-    "2024-03-30",  # Non-Instructional WD (Saturday)
-    "2024-03-31",  # Easter H (Sunday)
-    "2024-04-06",  # Non - Instructional WD (Saturday)
-    "2024-04-07",  # H (Sunday)
-    "2024-04-10",  # Id-ul-Fitr (Ramzan)* H
-    "2024-04-13",  # H (Saturday)
-    "2024-04-14",  # Vishu/Ambedkar Jayanti H (Sunday)
-    "2024-04-20",  # Instructional WD (Saturday)
-    "2024-04-21",  # H (Sunday)
-    "2024-04-27",  # H (Saturday)
-    "2024-04-28",  # H (Sunday)
-    "2024-05-01",  # May Day H
-    "2024-05-04",  # Non - Instructional WD (Saturday)
-    "2024-05-05",  # H (Sunday)
-    "2024-05-11",  # H (Saturday)
-    "2024-05-12",  # H (Sunday)
-    "2024-05-18",  # Instructional WD (Saturday)
-    "2024-05-19",  # H (Sunday)
-    "2024-05-25",  # H (Saturday)
-    "2024-05-26",  # H (Sunday)
-    "2024-06-01",  # Non - Instructional WD (Saturday)
-    "2024-06-02",  # H (Sunday)
-    "2024-06-08",  # H (Saturday)
-    "2024-06-09",  # H (Sunday)
-    "2024-06-15",  # H (Saturday)
-    "2024-06-16",  # H (Sunday)
-    "2024-06-17",  # Bakrid H
-    "2024-06-22",  # H (Saturday)
-    "2024-06-23",  # H (Sunday)
-    "2024-06-29",  # H (Saturday)
-    "2024-06-30",
-    "2024-10-02",
-    "2024-10-31",
-    "2024-12-25",
-    "2025-01-02",
-    "2025-01-02",
-]  # H (Sunday)
 
+# Process local copies of the holiday calendar, dropped whenever the shared
+# version below changes: the global holidays once, and the holidays of the
+# most recently used collections on top of them, at most
+# HOLIDAY_CACHE_COLLECTIONS of those
+_global_holidays = None
+_collection_holidays = OrderedDict()
+_holiday_cache_version = None
+HOLIDAY_VERSION_KEY = "holidays:version"
+HOLIDAY_CACHE_COLLECTIONS = 256
 
-def is_holiday(date: datetime.date):
-    if date.strftime("%Y-%m-%d") in HOLIDAYS:
-        return True
+
+def invalidate_holidays():
+    from django.core.cache import cache
+
+    # incr raises on missing keys, add is a no-op on existing ones
+    cache.add(HOLIDAY_VERSION_KEY, 0, timeout=None)
+    try:
+        cache.incr(HOLIDAY_VERSION_KEY)
+    except ValueError:
+        pass
+
+
+def holiday_ordinals(collection_id=None):
+    """Ordinals of every holiday that applies to the collection, the global
+    calendar when collection_id is None"""
+    global _global_holidays, _holiday_cache_version
+    from django.core.cache import cache
+
+    from api.models import Holiday
+
+    version = cache.get(HOLIDAY_VERSION_KEY, 0)
+    if version != _holiday_cache_version:
+        _global_holidays = None
+        _collection_holidays.clear()
+        _holiday_cache_version = version
+
+    if _global_holidays is None:
+        _global_holidays = frozenset(
+            date.toordinal()
+            for date in Holiday.objects.filter(collection__isnull=True).values_list(
+                "date", flat=True
+            )
+        )
+    if collection_id is None:
+        return _global_holidays
+
+    if collection_id in _collection_holidays:
+        _collection_holidays.move_to_end(collection_id)
     else:
-        return False
+        own = frozenset(
+            date.toordinal()
+            for date in Holiday.objects.filter(collection_id=collection_id).values_list(
+                "date", flat=True
+            )
+        )
+        # Most collections have no holidays of their own and share the set
+        _collection_holidays[collection_id] = (
+            _global_holidays | own if own else _global_holidays
+        )
+        if len(_collection_holidays) > HOLIDAY_CACHE_COLLECTIONS:
+            _collection_holidays.popitem(last=False)
+    return _collection_holidays[collection_id]
+
+
+def is_holiday(date: datetime.date, collection_id=None):
+    return date.toordinal() in holiday_ordinals(collection_id)
 
 
-def working_days(start_date, end_date):
-    current_date = start_date
-    while current_date <= end_date:
-        if current_date.weekday() not in [SA, SU] and not is_holiday(current_date):
-            yield current_date
-        current_date += timedelta(days=1)
+def working_days(start_date, end_date, collection_id=None):
+    """Every weekday between start_date and end_date (inclusive) that is not a holiday"""
+    holidays = holiday_ordinals(collection_id)
+    # date.fromordinal(1) is a monday, so weekday() == (ordinal - 1) % 7
+    return [
+        datetime.date.fromordinal(ordinal)
+        for ordinal in range(start_date.toordinal(), end_date.toordinal() + 1)
+        if (ordinal - 1) % 7 < SA and ordinal not in holidays
+    ]
@@ -0,0 +1,251 @@
+import csv
+import datetime
+import itertools
+import json
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from api.models import Collection, Course, Marketplace, Schedule, Session
+
+CHUNK_SIZE = 2000
+
+SESSION_COLUMNS = ["collection", "course", "date", "period", "status"]
+RECORD_TYPES = ["collection", "course", "schedule", "session"]
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "ics": "text/calendar",
+    "jsonl": "application/jsonl",
+}
+
+
+class _Echo:
+    """File-like object whose write returns the value, so csv.writer can
+    produce one line at a time"""
+
+    def write(self, value):
+        return value
+
+
+def _sessions(collections):
+    return (
+        Session.objects.filter(course__collection__in=collections)
+        .order_by("course__collection_id", "date", "course_id", "id")
+        .values_list(
+            "id", "course__collection__name", "course__name", "date", "period", "status"
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def export_csv(collections):
+    """Yield the sessions of the collections as CSV lines"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(SESSION_COLUMNS)
+    for _, collection, course, date, period, status in _sessions(collections):
+        yield writer.writerow([collection, course, date.isoformat(), period, status])
+
+
+def _ics_text(value):
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def export_ics(collections):
+    """Yield the sessions of the collections as all day iCalendar events"""
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Bunk Mate//Timetable//EN\r\n"
+    for session_id, collection, course, date, _, status in _sessions(collections):
+        end = date + datetime.timedelta(days=1)
+        yield (
+            "BEGIN:VEVENT\r\n"
+            f"UID:session-{session_id}@bunkmate\r\n"
+            f"DTSTAMP:{stamp}\r\n"
+            f"DTSTART;VALUE=DATE:{date:%Y%m%d}\r\n"
+            f"DTEND;VALUE=DATE:{end:%Y%m%d}\r\n"
+            f"SUMMARY:{_ics_text(course)}\r\n"
+            f"DESCRIPTION:{_ics_text(collection)} - {status}\r\n"
+            f"STATUS:{'CANCELLED' if status == 'cancelled' else 'CONFIRMED'}\r\n"
+            "END:VEVENT\r\n"
+        )
+    yield "END:VCALENDAR\r\n"
+
+
+def export_jsonl(collections):
+    """Yield one JSON record per line for every collection, course, schedule
+    and session, parents before children so import_jsonl can stream them"""
+
+    def records(record_type, queryset, *fields):
+        for row in queryset.values(*fields).iterator(chunk_size=CHUNK_SIZE):
+            yield json.dumps({"type": record_type, **row}, default=str) + "\n"
+
+    yield from records(
+        "collection",
+        Collection.objects.filter(id__in=collections).order_by("id"),
+        "id",
+        "user__username",
+        "name",
+        "shared",
+        "threshold",
+        "start_date",
+        "end_date",
+        "generated_until",
+    )
+    yield from records(
+        "course",
+        Course.objects.filter(collection__in=collections).order_by("id"),
+        "id",
+        "collection_id",
+        "name",
+    )
+    yield from records(
+        "schedule",
+        Schedule.objects.filter(course__collection__in=collections).order_by("id"),
+        "course_id",
+        "day_of_week",
+        "order",
+    )
+    yield from records(
+        "session",
+        Session.objects.filter(course__collection__in=collections).order_by("id"),
+        "course_id",
+        "date",
+        "period",
+        "status",
+    )
+
+
+EXPORTERS = {"csv": export_csv, "ics": export_ics, "jsonl": export_jsonl}
+
+
+def _chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def import_jsonl(lines, replace=False, batch_size=CHUNK_SIZE):
+    """Load an export_jsonl stream, inserting rows in batch_size chunks.
+    Collections of users that already have one are skipped unless replace
+    is set, returns the number of rows inserted per type"""
+    counts = dict.fromkeys(RECORD_TYPES, 0)
+    buffers = {record_type: [] for record_type in RECORD_TYPES}
+    collection_ids, course_ids = {}, {}
+
+    def collection(record):
+        user, _ = User.objects.get_or_create(username=record["user__username"])
+        existing = Collection.objects.filter(user=user)
+        if existing.exists():
+            if not replace:
+                return None
+            existing.delete()
+        created = Collection.objects.create(
+            user=user,
+            name=record["name"],
+            shared=record["shared"],
+            threshold=record["threshold"],
+            start_date=record["start_date"],
+            end_date=record["end_date"],
+            generated_until=record.get("generated_until"),
+        )
+        collection_ids[record["id"]] = created.id
+        return created
+
+    def flush(record_type):
+        records, buffers[record_type] = buffers[record_type], []
+        if record_type == "collection":
+            created = [c for c in map(collection, records) if c is not None]
+        elif record_type == "course":
+            records = [r for r in records if r["collection_id"] in collection_ids]
+            created = Course.objects.bulk_create(
+                Course(collection_id=collection_ids[r["collection_id"]], name=r["name"])
+                for r in records
+            )
+            course_ids.update((r["id"], c.id) for r, c in zip(records, created))
+        elif record_type == "schedule":
+            created = Schedule.objects.bulk_create(
+                Schedule(
+                    course_id=course_ids[r["course_id"]],
+                    day_of_week=r["day_of_week"],
+                    order=r["order"],
+                )
+                for r in records
+                if r["course_id"] in course_ids
+            )
+        else:
+            created = Session.objects.bulk_create(
+                Session(
+                    course_id=course_ids[r["course_id"]],
+                    date=r["date"],
+                    period=r.get("period"),
+                    status=r["status"],
+                )
+                for r in records
+                if r["course_id"] in course_ids
+            )
+        counts[record_type] += len(created)
+
+    with transaction.atomic():
+        for line in lines:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            level = RECORD_TYPES.index(record["type"])
+            # Parents have to exist before their children reference them
+            for parent in RECORD_TYPES[:level]:
+                if buffers[parent]:
+                    flush(parent)
+            buffers[record["type"]].append(record)
+            if len(buffers[record["type"]]) >= batch_size:
+                flush(record["type"])
+        for record_type in RECORD_TYPES:
+            flush(record_type)
+        for collection in Collection.objects.filter(
+            id__in=collection_ids.values(), shared=True
+        ):
+            Marketplace.objects.sync(collection)
+    return counts
+
+
+def import_csv(lines, collection, batch_size=CHUNK_SIZE):
+    """Load export_csv session rows into a collection, creating courses by
+    name as needed. Rows upsert on (course, date, period) so importing the
+    same file again only updates statuses, files without a period column
+    number a course's sessions on a date in file order. Returns the number
+    of sessions inserted or updated"""
+    courses = dict(collection.courses.values_list("name", "id"))
+    periods = Counter()
+    imported = 0
+    with transaction.atomic():
+        for chunk in _chunked(csv.DictReader(lines), batch_size):
+            missing = {row["course"] for row in chunk} - courses.keys()
+            for course in Course.objects.bulk_create(
+                Course(collection=collection, name=name) for name in sorted(missing)
+            ):
+                courses[course.name] = course.id
+            sessions = []
+            for row in chunk:
+                key = row["course"], row["date"]
+                periods[key] += 1
+                sessions.append(
+                    Session(
+                        course_id=courses[row["course"]],
+                        date=row["date"],
+                        period=row.get("period") or periods[key],
+                        status=row["status"],
+                    )
+                )
+            imported += len(
+                Session.objects.bulk_create(
+                    sessions,
+                    update_conflicts=True,
+                    unique_fields=["course", "date", "period"],
+                    update_fields=["status", "updated_at"],
+                )
+            )
+    return imported
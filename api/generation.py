@@ -0,0 +1,223 @@
+import datetime
+import itertools
+import logging
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q, Value
+from django.db.models.functions import Least
+
+from api.dateutils import working_days
+from api.models import ChangeLog, Collection, Schedule, Session
+
+BATCH_SIZE = 1000
+
+
+def window_end(today=None):
+    """Last day sessions are materialized for, None when whole ranges are"""
+    weeks = settings.SESSION_GENERATION["WINDOW_WEEKS"]
+    if not weeks:
+        return None
+    return (today or datetime.date.today()) + datetime.timedelta(weeks=weeks)
+
+
+def _expected_sessions(schedules, collection_id, start_date, end_date):
+    """Yield a session for every period each course has on a working day,
+    a course with two schedules on a day gets periods 1 and 2"""
+    by_weekday = defaultdict(list)
+    for (course_id, day_of_week), count in Counter(
+        schedules.values_list("course_id", "day_of_week")
+    ).items():
+        by_weekday[day_of_week].append((course_id, count))
+
+    for day in working_days(start_date, end_date, collection_id):
+        for course_id, count in by_weekday.get(day.isoweekday(), ()):
+            for period in range(1, count + 1):
+                yield Session(
+                    course_id=course_id, date=day, period=period, status="present"
+                )
+
+
+def _slot_filter(course_days, day_field="day_of_week"):
+    """Q matching every schedule, or with day_field="weekday" every session,
+    on one of the (course_id, day_of_week) pairs"""
+    query = Q(pk__in=[])
+    for course_id, day_of_week in course_days:
+        query |= Q(course_id=course_id, **{day_field: day_of_week})
+    return query
+
+
+def generate_sessions(
+    collection_id,
+    start_date,
+    end_date,
+    schedule_ids=None,
+    exclude_ids=None,
+    batch_size=BATCH_SIZE,
+):
+    """Insert the missing sessions of a collection's schedules between two
+    dates, clipped to the generation window, in batch_size chunks. Returns
+    the number of sessions inserted
+
+    Rows that already exist are skipped by the (course, date, period) unique
+    constraint, so reruns and overlapping ranges only fill the gaps. When
+    schedule_ids is given only the days those schedules fall on are
+    generated, together with the other schedules of the same course on the
+    same day. Schedules in exclude_ids are left out of the generation."""
+    end_date = min(end_date, window_end() or end_date)
+    with transaction.atomic():
+        # Lock the collection so retried or concurrent runs apply one at a time
+        collection = (
+            Collection.objects.select_for_update()
+            .filter(id=collection_id)
+            .only("start_date", "generated_until")
+            .first()
+        )
+        if collection is None or start_date > end_date:
+            return 0
+        schedules = Schedule.objects.filter(course__collection_id=collection_id)
+        sessions = Session.objects.filter(
+            course__collection_id=collection_id,
+            date__gte=start_date,
+            date__lte=end_date,
+        )
+        if schedule_ids is not None:
+            course_days = list(
+                schedules.filter(id__in=schedule_ids).values_list(
+                    "course_id", "day_of_week"
+                )
+            )
+            schedules = schedules.filter(_slot_filter(course_days))
+            sessions = sessions.filter(_slot_filter(course_days, "weekday"))
+        if exclude_ids:
+            schedules = schedules.exclude(id__in=exclude_ids)
+
+        # Rows inserted below get higher ids than any row committed so far
+        last_id = Session.objects.aggregate(Max("id", default=0))["id__max"]
+        expected = _expected_sessions(schedules, collection_id, start_date, end_date)
+        while batch := list(itertools.islice(expected, batch_size)):
+            Session.objects.bulk_create(batch, ignore_conflicts=True)
+        created = sessions.filter(id__gt=last_id)
+        inserted = created.count()
+        if inserted:
+            # Conflicting inserts return no primary keys to log individually,
+            # so the new rows are logged by id
+            ChangeLog.objects.record(created)
+
+        horizon = collection.generated_until or (
+            collection.start_date - datetime.timedelta(days=1)
+        )
+        if (
+            schedule_ids is None
+            and start_date <= horizon + datetime.timedelta(days=1)
+            and end_date > horizon
+        ):
+            Collection._base_manager.filter(id=collection_id).update(
+                generated_until=end_date
+            )
+
+    logging.info(
+        f"added {inserted} sessions for collection {collection_id} "
+        f"between {start_date} and {end_date}"
+    )
+    return inserted
+
+
+def generate_requested(collection_id, schedule_ids=(), whole_range=False, today=None):
+    """Generate what request_sessions queued over the collection's current
+    dates: every schedule but the ones in schedule_ids over the whole range
+    when whole_range is set, and the schedules in schedule_ids only after
+    today. That is the day trim_sessions keeps attendance up to, so a slot
+    added mid semester is not backfilled with sessions that never happened.
+    Returns the number of sessions inserted, None if the collection is gone"""
+    dates = (
+        Collection.objects.filter(id=collection_id)
+        .values_list("start_date", "end_date")
+        .first()
+    )
+    if dates is None:
+        return None
+    start_date, end_date = dates
+    inserted = 0
+    if whole_range:
+        inserted += generate_sessions(
+            collection_id, start_date, end_date, exclude_ids=schedule_ids
+        )
+    if schedule_ids:
+        tomorrow = (today or datetime.date.today()) + datetime.timedelta(days=1)
+        inserted += generate_sessions(
+            collection_id,
+            max(start_date, tomorrow),
+            end_date,
+            schedule_ids=schedule_ids,
+        )
+    return inserted
+
+
+def due_collections(partition=0, partitions=1, today=None):
+    """Collections whose sessions stop short of the window or their end
+    date, those with id % partitions == partition"""
+    horizon = window_end(today)
+    target = F("end_date") if horizon is None else Least("end_date", Value(horizon))
+    return (
+        Collection.objects.filter(
+            Q(generated_until__isnull=True) | Q(generated_until__lt=target)
+        )
+        .annotate(partition=F("id") % partitions)
+        .filter(partition=partition)
+        .only("start_date", "end_date", "generated_until")
+    )
+
+
+def roll_sessions(collection):
+    """Generate only the days between the collection's horizon and the end of
+    the window, returns the number of sessions inserted"""
+    start_date = collection.start_date
+    if collection.generated_until is not None:
+        start_date = max(
+            start_date, collection.generated_until + datetime.timedelta(days=1)
+        )
+    return generate_sessions(collection.id, start_date, collection.end_date)
+
+
+def trim_sessions(course_days, after=None):
+    """Delete the sessions after a date (today by default) that exceed the
+    number of schedules their course has on that weekday, so removing a slot
+    drops its upcoming sessions but keeps attendance already marked"""
+    course_days = set(course_days)
+    if not course_days:
+        return 0
+    after = after or datetime.date.today()
+
+    expected = Counter(
+        Schedule.objects.filter(_slot_filter(course_days)).values_list(
+            "course_id", "day_of_week"
+        )
+    )
+    trimmed = 0
+
+    # Slots with no schedules left lose all their upcoming sessions, one
+    # delete over the (course, weekday, date) index
+    emptied = [slot for slot in course_days if not expected[slot]]
+    if emptied:
+        trimmed += Session.objects.filter(
+            _slot_filter(emptied, "weekday"), date__gt=after
+        ).delete()[0]
+
+    surplus = []
+    kept = Counter()
+    sessions = Session.objects.filter(
+        _slot_filter(course_days - set(emptied), "weekday"), date__gt=after
+    ).order_by("date", "period", "id")
+    for session_id, course_id, weekday, date in sessions.values_list(
+        "id", "course_id", "weekday", "date"
+    ):
+        slot = (course_id, weekday)
+        kept[slot, date] += 1
+        if kept[slot, date] > expected[slot]:
+            surplus.append(session_id)
+
+    if surplus:
+        Session.objects.filter(id__in=surplus).delete()
+    return trimmed + len(surplus)
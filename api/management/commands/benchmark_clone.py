@@ -0,0 +1,149 @@
+import datetime
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from api.generation import generate_sessions
+from api.models import Collection, Schedule, Session
+from api.timetable import clone_collection, create_grid
+
+
+class Command(BaseCommand):
+    help = "Benchmark concurrent adopters of a shared timetable with make_clone against clone_collection, the benchmark users are deleted afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--adopters", nargs="+", type=int, default=[100, 500])
+        parser.add_argument("--periods", type=int, default=8)
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Adoptions running at once, each thread holds a database connection",
+        )
+
+    def template(self):
+        owner = User.objects.create(username="benchmark_template")
+        template = Collection.objects.create(
+            user=owner,
+            name="benchmark",
+            shared=True,
+            start_date=datetime.date(2024, 1, 8),
+            end_date=datetime.date(2024, 5, 31),
+        )
+        create_grid(
+            template,
+            [
+                [f"course_{(day + order) % 10}" for day in range(5)]
+                for order in range(self.periods)
+            ],
+        )
+        generate_sessions(template.id, template.start_date, template.end_date)
+        return template
+
+    def make_clone(self, template, user):
+        # The previous CollectionSelector path: a recursive clone followed by
+        # a full semester of session generation. make_clone also copies the
+        # template owner's User under a unique name and gives up after 100
+        # copies, those adopters are counted as failures
+        clone = template.make_clone(attrs={"shared": False, "user": user})
+        generate_sessions(clone.id, clone.start_date, clone.end_date)
+
+    def fast_clone(self, template, user):
+        clone_collection(template, user)
+
+    def adopt(self, method, template, users):
+        """Run the adoptions from a pool of threads, each with its own
+        connection, returns the latency and error of every adoption"""
+        results = []
+        lock = threading.Lock()
+
+        def count(execute, sql, *args):
+            with lock:
+                self.queries += 1
+            return execute(sql, *args)
+
+        def worker(user):
+            start = time.perf_counter()
+            error = None
+            try:
+                with connection.execute_wrapper(count):
+                    method(template, user)
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {str(exc).splitlines()[0][:120]}"
+            with lock:
+                results.append((time.perf_counter() - start, error))
+
+        def work(users):
+            try:
+                for user in users:
+                    worker(user)
+            finally:
+                connection.close()
+
+        chunks = [users[i :: self.concurrency] for i in range(self.concurrency)]
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            list(pool.map(work, chunks))
+        return results
+
+    def run(self, method, adopters):
+        users = []
+        self.queries = 0
+        try:
+            template = self.template()
+            users = User.objects.bulk_create(
+                User(username=f"benchmark_{i}") for i in range(adopters)
+            )
+            start = time.perf_counter()
+            results = self.adopt(method, template, users)
+            elapsed = time.perf_counter() - start
+            sessions = Session.objects.filter(course__collection__user__in=users).count()
+            schedules = Schedule.objects.filter(course__collection__user__in=users).count()
+        finally:
+            # Adoptions commit from their own connections, so nothing can be
+            # rolled back, make_clone also leaves copies of the template owner
+            User.objects.filter(
+                Q(id__in=[user.id for user in users])
+                | Q(username__startswith="benchmark_template")
+            ).delete()
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        errors = Counter(error for _, error in results if error)
+        return elapsed, sessions, schedules, latencies, errors
+
+    def handle(self, *args, **options):
+        self.periods = options["periods"]
+        self.concurrency = options["concurrency"]
+        for adopters in options["adopters"]:
+            results = {}
+            for name, method in [
+                ("make_clone", self.make_clone),
+                ("clone_collection", self.fast_clone),
+            ]:
+                elapsed, sessions, schedules, latencies, errors = self.run(
+                    method, adopters
+                )
+                # Failed adoptions end early, only completed ones count
+                results[name] = (adopters - sum(errors.values())) / elapsed
+                p50, p95 = statistics.quantiles(latencies, n=100)[49::45]
+                self.stdout.write(
+                    f"{name:<16} adopters={adopters} seconds={elapsed:.2f} "
+                    f"completed/s={results[name]:.1f} "
+                    f"p50_ms={p50:.1f} p95_ms={p95:.1f} "
+                    f"queries/adopter={self.queries / adopters:.1f} "
+                    f"schedules={schedules} sessions={sessions} "
+                    f"failed={sum(errors.values())}"
+                )
+                for error, count in errors.most_common():
+                    self.stdout.write(f"    {count} x {error}")
+            speedup = results["clone_collection"] / max(results["make_clone"], 1e-9)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"completed adoptions/s at {adopters} adopters: {speedup:.1f}x"
+                )
+            )
@@ -0,0 +1,73 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.serializers import CollectionSerializer
+
+# Collection insert, course bulk insert, schedule bulk insert, a change log
+# insert for each of them and the savepoint pair around them, independent
+# of the timetable size
+EXPECTED_QUERIES = 8
+
+
+class Command(BaseCommand):
+    help = "Benchmark collection creation for different timetable sizes, all data is rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[4, 8, 12])
+        parser.add_argument("--courses", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def grid(self, periods, courses):
+        return [
+            [f"course_{(day * periods + order) % courses}" for day in range(5)]
+            for order in range(periods)
+        ]
+
+    def handle(self, *args, **options):
+        failures = []
+        for periods in options["sizes"]:
+            data = {
+                "name": "benchmark",
+                "start_date": "2024-01-08",
+                "end_date": "2024-05-31",
+                "courses_data": self.grid(periods, options["courses"]),
+            }
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(username=f"benchmark_{i}") for i in range(options["repeat"])
+                )
+                serializers = []
+                for user in users:
+                    serializer = CollectionSerializer(data=data)
+                    serializer.is_valid(raise_exception=True)
+                    serializers.append((serializer, user))
+
+                queries = []
+                with connection.execute_wrapper(
+                    lambda execute, sql, *args: queries.append(sql)
+                    or execute(sql, *args)
+                ):
+                    start = time.perf_counter()
+                    for serializer, user in serializers:
+                        serializer.save(user=user)
+                    elapsed = time.perf_counter() - start
+                # Session generation is queued on commit, which never happens here
+                transaction.set_rollback(True)
+
+            per_collection = len(queries) / options["repeat"]
+            self.stdout.write(
+                f"grid={periods}x5 ms/collection={elapsed / options['repeat'] * 1000:.2f} "
+                f"queries/collection={per_collection:.1f}"
+            )
+            if per_collection > EXPECTED_QUERIES:
+                failures.append(f"{periods}x5 took {per_collection} queries")
+
+        if failures:
+            raise CommandError(
+                f"expected at most {EXPECTED_QUERIES} queries per collection: "
+                + ", ".join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS("query counts are independent of grid size"))
@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from api.models import Collection, Schedule
+from api.timetable import build_grid, create_grid
+
+
+def legacy_grid(collection):
+    # The previous CollectionView.get implementation, one aggregate, one
+    # query per day and a lazy course fetch per schedule
+    schedules = Schedule.objects.filter(course__collection=collection)
+    max_order = schedules.aggregate(Max("order", default=1))["order__max"]
+    template = [[""] * 5 for i in range(max_order)]
+    for day in range(0, 5):
+        schedules_on_day = schedules.filter(day_of_week=day + 1).order_by("order")
+        for schedule in schedules_on_day:
+            template[schedule.order - 1][schedule.day_of_week - 1] = schedule.course.name
+    return template
+
+
+class Command(BaseCommand):
+    help = "Benchmark rendering the timetable grid, all data is rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--periods", type=int, default=8)
+        parser.add_argument("--repeat", type=int, default=200)
+
+    def measure(self, builder, collection, repeat):
+        queries = []
+        with connection.execute_wrapper(
+            lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)
+        ):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                grid = builder(collection)
+            elapsed = time.perf_counter() - start
+        return grid, elapsed / repeat * 1000, len(queries) / repeat
+
+    def handle(self, *args, **options):
+        periods, repeat = options["periods"], options["repeat"]
+        with transaction.atomic():
+            collection = Collection.objects.create(
+                user=User.objects.create(username="benchmark_grid"),
+                name="benchmark",
+                start_date="2024-01-08",
+                end_date="2024-05-31",
+            )
+            data = [
+                [f"course_{(day + order) % 10}" for day in range(5)]
+                for order in range(periods)
+            ]
+            create_grid(collection, data)
+
+            legacy, legacy_ms, legacy_queries = self.measure(
+                legacy_grid, collection, repeat
+            )
+            grid, grid_ms, grid_queries = self.measure(build_grid, collection, repeat)
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"legacy     ms/render={legacy_ms:.3f} queries/render={legacy_queries:.0f}"
+        )
+        self.stdout.write(
+            f"build_grid ms/render={grid_ms:.3f} queries/render={grid_queries:.0f}"
+        )
+        if grid != data or legacy != data:
+            raise CommandError("rendered grid does not match the timetable")
+        if grid_queries != 1:
+            raise CommandError(f"build_grid took {grid_queries} queries, expected 1")
+        self.stdout.write(self.style.SUCCESS("build_grid renders in a single query"))
@@ -0,0 +1,91 @@
+import datetime
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.generation import BATCH_SIZE, generate_sessions
+from api.models import Collection, Course, Schedule, Session
+
+
+class Command(BaseCommand):
+    help = "Benchmark semester session generation, all data is rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collections", type=int, default=1000)
+        parser.add_argument("--courses", type=int, default=8)
+        parser.add_argument("--periods", type=int, default=6)
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--start-date", default="2024-01-08")
+        parser.add_argument("--end-date", default="2024-05-31")
+
+    def seed(self, options):
+        users = User.objects.bulk_create(
+            User(username=f"benchmark_{i}") for i in range(options["collections"])
+        )
+        collections = Collection.objects.bulk_create(
+            Collection(
+                user=user,
+                name=f"benchmark_{user.username}",
+                start_date=self.start_date,
+                end_date=self.end_date,
+            )
+            for user in users
+        )
+        courses = Course.objects.bulk_create(
+            Course(collection=collection, name=f"course_{i}")
+            for collection in collections
+            for i in range(options["courses"])
+        )
+        Schedule.objects.bulk_create(
+            Schedule(
+                course=courses[
+                    c * options["courses"] + (day + order) % options["courses"]
+                ],
+                day_of_week=day + 1,
+                order=order + 1,
+            )
+            for c in range(len(collections))
+            for day in range(5)
+            for order in range(options["periods"])
+        )
+        return collections
+
+    def handle(self, *args, **options):
+        self.start_date = datetime.date.fromisoformat(options["start_date"])
+        self.end_date = datetime.date.fromisoformat(options["end_date"])
+
+        with transaction.atomic():
+            collections = self.seed(options)
+
+            queries = []
+            with connection.execute_wrapper(
+                lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)
+            ):
+                start = time.perf_counter()
+                inserted = sum(
+                    generate_sessions(
+                        collection.id,
+                        self.start_date,
+                        self.end_date,
+                        batch_size=options["batch_size"],
+                    )
+                    for collection in collections
+                )
+                elapsed = time.perf_counter() - start
+
+            # A second run must not insert anything
+            rerun = generate_sessions(collections[0].id, self.start_date, self.end_date)
+            total = Session.objects.filter(course__collection__in=collections).count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"collections={len(collections)} sessions={inserted} "
+            f"seconds={elapsed:.2f} sessions/s={inserted / elapsed:.0f} "
+            f"queries={len(queries)} queries/collection={len(queries) / len(collections):.1f}"
+        )
+        if rerun or total != inserted:
+            self.stderr.write(f"rerun inserted {rerun} duplicate sessions")
+        else:
+            self.stdout.write(self.style.SUCCESS("rerun inserted no duplicates"))
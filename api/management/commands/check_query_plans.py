@@ -0,0 +1,112 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+
+from api import stats
+from api.generation import generate_sessions
+from api.models import ChangeLog, Collection, Course, Schedule, Session
+from api.timetable import create_grid
+
+
+def hot_queries(collection, today):
+    """The Session access patterns of the views and tasks, by name"""
+    courses = Course.objects.filter(collection=collection)
+    course = courses.first()
+    course_ids = list(courses.values_list("id", flat=True))
+    sessions = Session.objects.filter(course=course)
+
+    return {
+        "datequery": courses.filter(sessions__date=today)
+        .annotate(status=F("sessions__status"))
+        .annotate(s_id=F("sessions__id")),
+        "bulk_cancel": Session.objects.filter(
+            course__collection=collection,
+            date__gte=today,
+            date__lte=today + datetime.timedelta(days=7),
+        ),
+        "course_stats": sessions.order_by()
+        .values("course")
+        .annotate(**stats.count_expressions(today)),
+        "counter_rebuild": Session.objects.filter(course_id__in=course_ids)
+        .order_by()
+        .values("course_id")
+        .annotate(**stats.counter_expressions(today)),
+        "bunks_taken": sessions.filter(status="bunked", date__lte=today),
+        "active_sessions": sessions.exclude(status="cancelled"),
+        "slot_delete": sessions.filter(weekday=1, date__gt=today),
+        "trim_sessions": Session.objects.filter(
+            course_id__in=course_ids, date__gt=today
+        ).order_by("date", "id"),
+        "generation_existing": Session.objects.filter(
+            course_id__in=Schedule.objects.filter(
+                course__collection=collection
+            ).values("course_id"),
+            date__gte=collection.start_date,
+            date__lte=collection.end_date,
+        ),
+        "sync_changes": ChangeLog.objects.filter(
+            user_id=collection.user_id,
+            id__gt=ChangeLog.objects.order_by("-id").values_list("id", flat=True)[0]
+            - 100,
+        ).order_by("id"),
+    }
+
+
+def seed(count, today):
+    """Users with a collection of ten courses over eight periods and a
+    semester of sessions around today"""
+    start_date = today - datetime.timedelta(days=70)
+    end_date = today + datetime.timedelta(days=70)
+    grid = [
+        [f"course_{(day + order) % 10}" for day in range(5)] for order in range(8)
+    ]
+    users = User.objects.bulk_create(
+        User(username=f"plan_check_{i}") for i in range(count)
+    )
+    collections = Collection.objects.bulk_create(
+        Collection(
+            user=user, name="plan_check", start_date=start_date, end_date=end_date
+        )
+        for user in users
+    )
+    for collection in collections:
+        create_grid(collection, grid)
+        generate_sessions(collection.id, start_date, end_date)
+    return collections
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot Session queries against seeded data and fail on sequential scans, all data is rolled back afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--collections", type=int, default=200)
+        parser.add_argument("--verbose-plans", action="store_true")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Query plans can only be checked against Postgres")
+
+        today = datetime.date.today()
+        failures = []
+        with transaction.atomic():
+            collections = seed(options["collections"], today)
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+            for name, queryset in hot_queries(collections[0], today).items():
+                plan = queryset.explain()
+                if options["verbose_plans"]:
+                    self.stdout.write(f"{name}:\n{plan}\n")
+                if "Seq Scan" in plan:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(f"{name}: sequential scan\n{plan}"))
+                else:
+                    self.stdout.write(f"{name}: ok")
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"Sequential scans in: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS("All hot queries use indexes"))
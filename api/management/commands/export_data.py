@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.exports import EXPORTERS
+from api.models import Collection
+
+
+class Command(BaseCommand):
+    help = "Stream collections with their courses, schedules and sessions to a file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORTERS), default="jsonl")
+        parser.add_argument("--output", default="-", help="File path, - for stdout")
+        parser.add_argument(
+            "--collection",
+            type=int,
+            action="append",
+            help="Collection id to export, repeatable, defaults to every collection",
+        )
+        parser.add_argument("--user", action="append", help="Export this user's collection")
+
+    def handle(self, *args, **options):
+        collections = Collection.objects.all()
+        if options["collection"] or options["user"]:
+            collections = collections.filter(id__in=options["collection"] or []) | (
+                collections.filter(user__username__in=options["user"] or [])
+            )
+
+        output = (
+            sys.stdout
+            if options["output"] == "-"
+            else open(options["output"], "w", newline="")
+        )
+        try:
+            for chunk in EXPORTERS[options["format"]](collections):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
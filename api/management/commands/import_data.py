@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import CHUNK_SIZE, import_csv, import_jsonl
+from api.models import Collection
+
+
+class Command(BaseCommand):
+    help = "Import an export_data JSON Lines file, or CSV sessions into one user's collection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            help="Replace the collections of users that already have one",
+        )
+        parser.add_argument("--user", help="Owner of the collection CSV rows go into")
+        parser.add_argument("--batch-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        with open(options["path"], newline="") as lines:
+            if options["format"] == "jsonl":
+                counts = import_jsonl(
+                    lines, replace=options["replace"], batch_size=options["batch_size"]
+                )
+                summary = ", ".join(f"{count} {name}s" for name, count in counts.items())
+            else:
+                if not options["user"]:
+                    raise CommandError("--user is required for CSV imports")
+                try:
+                    collection = Collection.objects.get(user__username=options["user"])
+                except Collection.DoesNotExist:
+                    raise CommandError(f"{options['user']} has no collection")
+                imported = import_csv(
+                    lines, collection, batch_size=options["batch_size"]
+                )
+                summary = f"{imported} sessions"
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary}"))
@@ -0,0 +1,58 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from api import stats
+from api.models import AttendanceCounter, Course
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized attendance counters and verify them against sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only verify the stored counters, do not rebuild them",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        batch_size = options["batch_size"]
+        course_ids = list(Course.objects.order_by("id").values_list("id", flat=True))
+
+        if not options["check"]:
+            for i in range(0, len(course_ids), batch_size):
+                AttendanceCounter.objects.rebuild(course_ids[i : i + batch_size], today)
+            self.stdout.write(f"Rebuilt counters for {len(course_ids)} courses")
+
+        # Each counter is checked against the day it was split on, counters
+        # that are missing or from an earlier day are rebuilt on first read
+        stored = {f"stored_{field}": F(f"counter__{field}") for field in stats.COUNTER_FIELDS}
+        rows = (
+            Course.objects.order_by()
+            .filter(counter__isnull=False)
+            .annotate(
+                **stored,
+                **stats.counter_expressions(F("counter__as_of"), prefix="sessions__"),
+            )
+            .values("id", *stored, *stats.COUNTER_FIELDS)
+        )
+
+        mismatched = [
+            row["id"]
+            for row in rows.iterator(chunk_size=batch_size)
+            if any(row[f"stored_{field}"] != row[field] for field in stats.COUNTER_FIELDS)
+        ]
+        if mismatched:
+            raise CommandError(
+                f"{len(mismatched)} courses have incorrect counters: {mismatched[:20]}"
+            )
+        missing = Course.objects.filter(counter__isnull=True).count()
+        if missing:
+            self.stdout.write(f"{missing} courses have no counters yet")
+        self.stdout.write(
+            self.style.SUCCESS(f"Verified counters for {len(course_ids)} courses")
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_collection_generation
+from api.generation import due_collections, roll_sessions
+
+
+class Command(BaseCommand):
+    help = "Generate the sessions of every collection up to the end of the generation window, the roll_sessions beat job without celery"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partition", type=int, default=0)
+        parser.add_argument("--partitions", type=int, default=1)
+
+    def handle(self, *args, **options):
+        inserted = collections = 0
+        for collection in due_collections(
+            options["partition"], options["partitions"]
+        ).iterator():
+            added = roll_sessions(collection)
+            if added:
+                bump_collection_generation(collection.id)
+            inserted += added
+            collections += 1
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Inserted {inserted} sessions for {collections} collections"
+            )
+        )
@@ -0,0 +1,100 @@
+import datetime
+import json
+import os
+import subprocess
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Run the bruno scenarios against seeded benchmark users and save latency percentiles, throughput and queries per request as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Base url of a running server, requests go through the test client in process otherwise",
+        )
+        parser.add_argument(
+            "--scenarios",
+            nargs="+",
+            choices=benchmarks.SCENARIOS,
+            default=list(benchmarks.SCENARIOS),
+        )
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Defaults to benchmark_results/<time>.json")
+        parser.add_argument("--compare", help="Earlier results file to print deltas against")
+
+    def revision(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        try:
+            ctx = benchmarks.Context(
+                benchmarks.Transport(options["url"]), options["users"], options["seed"]
+            )
+        except RuntimeError as exc:
+            raise CommandError(exc)
+
+        started = datetime.datetime.now(datetime.timezone.utc)
+        results = {
+            "started_at": started.isoformat(),
+            "revision": self.revision(),
+            "database": connection.vendor,
+            "url": options["url"],
+            "users": len(ctx.users),
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "scenarios": {},
+        }
+        for scenario in options["scenarios"]:
+            result = benchmarks.run(
+                ctx,
+                scenario,
+                options["requests"],
+                options["concurrency"],
+                options["seed"],
+            )
+            results["scenarios"][scenario] = result
+            self.stdout.write(
+                f"{scenario:<17} p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+                f"p99={result['p99_ms']}ms rps={result['throughput_rps']} "
+                f"queries={result['queries_mean']} errors={result['errors']} "
+                f"cache_hits={result['cache_hits']}"
+            )
+
+        output = options["output"] or os.path.join(
+            "benchmark_results", f"{started:%Y%m%dT%H%M%S}.json"
+        )
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Saved results to {output}"))
+
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                baseline = json.load(file)["scenarios"]
+            for scenario, result in results["scenarios"].items():
+                if scenario not in baseline:
+                    continue
+                before = baseline[scenario]
+                self.stdout.write(
+                    f"{scenario:<17} p95 {before['p95_ms']} -> {result['p95_ms']}ms "
+                    f"({(result['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%), "
+                    f"rps {before['throughput_rps']} -> {result['throughput_rps']} "
+                    f"({(result['throughput_rps'] / before['throughput_rps'] - 1) * 100:+.0f}%), "
+                    f"queries {before['queries_mean']} -> {result['queries_mean']}"
+                )
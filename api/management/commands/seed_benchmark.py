@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Create benchmark users, each with a semester of courses and sessions, for run_benchmark"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--courses", type=int, default=8)
+        parser.add_argument("--periods", type=int, default=6)
+        parser.add_argument("--weeks", type=int, default=18)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Delete the existing benchmark users first",
+        )
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            self.stdout.write(f"Deleted {benchmarks.clear()} rows")
+        start = time.perf_counter()
+        sessions = benchmarks.seed(
+            options["users"],
+            options["courses"],
+            periods=options["periods"],
+            weeks=options["weeks"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {sessions} sessions in {time.perf_counter() - start:.1f}s"
+            )
+        )
@@ -0,0 +1,136 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+PREFIX = "bunkmate_request"
+METRICS_KEY = "metrics:requests"
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# name: (type, help)
+SERIES = {
+    "total": ("counter", "Requests handled"),
+    "queries_total": ("counter", "SQL queries run"),
+    "db_seconds_total": ("counter", "Time spent in SQL queries"),
+    "serializer_seconds_total": ("counter", "Time spent in serializer to_representation"),
+    "response_bytes_total": ("counter", "Size of non streaming response bodies"),
+    "over_threshold_total": ("counter", "Requests that ran more queries than the threshold"),
+    "seconds": ("histogram", "Request duration"),
+    "query_count": ("histogram", "SQL queries per request"),
+}
+
+# Serializer time of the request being handled, set by the middleware
+serializer_time = contextvars.ContextVar("serializer_time", default=None)
+
+_local = defaultdict(float)
+_local_lock = threading.Lock()
+
+
+def get_settings():
+    return {
+        "ENABLED": True,
+        "QUERY_THRESHOLD": 20,
+        "TOKEN": None,
+        **getattr(settings, "METRICS", {}),
+    }
+
+
+def _redis():
+    """The redis client behind the default cache, None for other backends"""
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _fields(view, method, sample):
+    labels = f'view="{view}",method="{method}"'
+    fields = {
+        f"total|{labels}": 1,
+        f"queries_total|{labels}": sample["queries"],
+        f"db_seconds_total|{labels}": sample["db_seconds"],
+        f"serializer_seconds_total|{labels}": sample["serializer_seconds"],
+        f"response_bytes_total|{labels}": sample["response_bytes"],
+        f"over_threshold_total|{labels}": int(sample["over_threshold"]),
+    }
+    # Buckets are stored cumulative, as prometheus expects them
+    for name, value, buckets in [
+        ("seconds", sample["seconds"], DURATION_BUCKETS),
+        ("query_count", sample["queries"], QUERY_BUCKETS),
+    ]:
+        for bucket in (*buckets, "+Inf"):
+            if bucket == "+Inf" or value <= bucket:
+                fields[f"{name}_bucket|{labels},le=\"{bucket}\""] = 1
+        fields[f"{name}_sum|{labels}"] = value
+        fields[f"{name}_count|{labels}"] = 1
+    return fields
+
+
+def record(view, method, sample):
+    """Add one request's sample to the shared totals with a single round trip"""
+    fields = _fields(view, method, sample)
+    client = _redis()
+    if client is None:
+        with _local_lock:
+            for field, value in fields.items():
+                _local[field] += value
+        return
+    pipeline = client.pipeline(transaction=False)
+    for field, value in fields.items():
+        pipeline.hincrbyfloat(METRICS_KEY, field, value)
+    pipeline.execute()
+
+
+def _totals():
+    client = _redis()
+    if client is None:
+        with _local_lock:
+            return dict(_local)
+    return {
+        field.decode(): float(value)
+        for field, value in client.hgetall(METRICS_KEY).items()
+    }
+
+
+def render():
+    """The totals in the prometheus text exposition format"""
+    def order(item):
+        field, _ = item
+        labels, _, bucket = field.partition(',le="')
+        return labels, float(bucket.rstrip('"').replace("+Inf", "inf") or 0)
+
+    series = defaultdict(list)
+    for field, value in sorted(_totals().items(), key=order):
+        name, labels = field.split("|", 1)
+        series[name].append(f"{PREFIX}_{name}{{{labels}}} {value:g}")
+
+    lines = []
+    for name, (kind, description) in SERIES.items():
+        lines += [
+            f"# HELP {PREFIX}_{name} {description}",
+            f"# TYPE {PREFIX}_{name} {kind}",
+        ]
+        if kind == "histogram":
+            for suffix in ("_bucket", "_sum", "_count"):
+                lines += series[name + suffix]
+        else:
+            lines += series[name]
+    return "\n".join(lines) + "\n"
+
+
+class TimedSerializerMixin:
+    """Adds the time spent in to_representation to the current request's
+    serializer time, list serializers are timed through their child"""
+
+    def to_representation(self, instance):
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            elapsed = serializer_time.get()
+            if elapsed is not None:
+                elapsed[0] += time.perf_counter() - start
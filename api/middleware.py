@@ -0,0 +1,119 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connection
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _add_wrapper(wrapper):
+    connection.execute_wrappers.append(wrapper)
+
+
+def _remove_wrapper(wrapper):
+    connection.execute_wrappers.remove(wrapper)
+
+
+class QueryMetricsMiddleware:
+    """Counts the SQL queries, database time, serializer time and response
+    size of every request, per view. The totals are exported by MetricsView
+    and each response gets a Server-Timing header"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = metrics.get_settings()
+        if not config["ENABLED"]:
+            return self.get_response(request)
+
+        count, queries = self._counter()
+        serializer_time = [0.0]
+        token = metrics.serializer_time.set(serializer_time)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count):
+                response = self.get_response(request)
+        finally:
+            metrics.serializer_time.reset(token)
+        elapsed = time.perf_counter() - start
+
+        self._record(config, request, response, queries, serializer_time, elapsed)
+        return response
+
+    async def __acall__(self, request):
+        config = metrics.get_settings()
+        if not config["ENABLED"]:
+            return await self.get_response(request)
+
+        count, queries = self._counter()
+        serializer_time = [0.0]
+        token = metrics.serializer_time.set(serializer_time)
+        start = time.perf_counter()
+        # Connections belong to the thread the request's ORM calls run in,
+        # not the event loop's
+        await sync_to_async(_add_wrapper)(count)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(_remove_wrapper)(count)
+            metrics.serializer_time.reset(token)
+        elapsed = time.perf_counter() - start
+
+        await sync_to_async(self._record)(
+            config, request, response, queries, serializer_time, elapsed
+        )
+        return response
+
+    def _counter(self):
+        queries = [0, 0.0]
+
+        def count(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += time.perf_counter() - start
+
+        return count, queries
+
+    def _record(self, config, request, response, queries, serializer_time, elapsed):
+        match = request.resolver_match
+        view = (
+            getattr(match.func, "view_class", match.func).__name__
+            if match
+            else "unmatched"
+        )
+        sample = {
+            "queries": queries[0],
+            "db_seconds": queries[1],
+            "serializer_seconds": serializer_time[0],
+            "response_bytes": 0 if response.streaming else len(response.content),
+            "seconds": elapsed,
+            "over_threshold": queries[0] > config["QUERY_THRESHOLD"],
+        }
+        if sample["over_threshold"]:
+            logger.warning(
+                f"{request.method} {request.path} ({view}) ran {queries[0]} queries "
+                f"in {queries[1] * 1000:.1f}ms, threshold is {config['QUERY_THRESHOLD']}"
+            )
+        metrics.record(view, request.method, sample)
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={queries[1] * 1000:.1f};desc="{queries[0]} queries"',
+                f"serializer;dur={serializer_time[0] * 1000:.1f}",
+                f"total;dur={elapsed * 1000:.1f}",
+            ]
+        )
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_alter_schedule_day_of_week'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceCounter',
+            fields=[
+                ('course', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='api.course')),
+                ('as_of', models.DateField()),
+                ('past_present', models.IntegerField(default=0)),
+                ('past_bunked', models.IntegerField(default=0)),
+                ('past_cancelled', models.IntegerField(default=0)),
+                ('future_present', models.IntegerField(default=0)),
+                ('future_bunked', models.IntegerField(default=0)),
+                ('future_cancelled', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
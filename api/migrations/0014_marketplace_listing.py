@@ -0,0 +1,64 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    # Matches the expression SearchVector("name", config="simple") compiles to
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE INDEX api_marketplace_name_search ON api_marketplace "
+            "USING gin (to_tsvector('simple'::regconfig, COALESCE(name, '')))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS api_marketplace_name_search")
+
+
+def list_shared_collections(apps, schema_editor):
+    Collection = apps.get_model("api", "Collection")
+    Marketplace = apps.get_model("api", "Marketplace")
+    Marketplace.objects.bulk_create(
+        Marketplace(
+            collection=collection,
+            name=collection.name,
+            search_name=collection.name.lower(),
+            course_count=collection.course_count,
+            start_date=collection.start_date,
+            end_date=collection.end_date,
+        )
+        for collection in Collection.objects.filter(shared=True).annotate(
+            course_count=models.Count("courses")
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_holiday'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='Marketplace',
+        ),
+        migrations.CreateModel(
+            name='Marketplace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=120)),
+                ('search_name', models.CharField(db_index=True, max_length=120)),
+                ('course_count', models.IntegerField(default=0)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('adopter_count', models.IntegerField(default=0)),
+                ('collection', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='listing', to='api.collection')),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(list_shared_collections, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_marketplace_listing'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['course', 'date'], name='session_course_date'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['course', 'status', 'date'], name='session_course_status_date'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(condition=models.Q(('status', 'cancelled'), _negated=True), fields=['course', 'date'], name='session_course_date_active'),
+        ),
+        migrations.AlterField(
+            model_name='session',
+            name='course',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='api.course'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:34
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_sync_changelog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='weekday',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.datetime.ExtractIsoWeekDay('date'), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['course', 'weekday', 'date'], name='session_course_weekday_date'),
+        ),
+    ]
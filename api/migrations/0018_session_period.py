@@ -0,0 +1,62 @@
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def number_periods(apps, schema_editor):
+    Session = apps.get_model("api", "Session")
+    duplicated = (
+        Session.objects.order_by()
+        .values("course_id", "date")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+    )
+    for row in duplicated.iterator():
+        sessions = list(
+            Session.objects.filter(course_id=row["course_id"], date=row["date"]).order_by(
+                "id"
+            )
+        )
+        for period, session in enumerate(sessions, 1):
+            session.period = period
+        Session.objects.bulk_update(sessions, ["period"])
+
+
+def mark_generated(apps, schema_editor):
+    # Collections with sessions were generated for their whole range
+    Collection = apps.get_model("api", "Collection")
+    Collection.objects.filter(courses__sessions__isnull=False).distinct().update(
+        generated_until=F("end_date")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_session_weekday"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="session",
+            name="period",
+            field=models.PositiveSmallIntegerField(default=1),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_periods, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="session",
+            constraint=models.UniqueConstraint(
+                fields=("course", "date", "period"), name="unique_session_period"
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="session",
+            name="session_course_date",
+        ),
+        migrations.AddField(
+            model_name="collection",
+            name="generated_until",
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_generated, migrations.RunPython.noop),
+    ]
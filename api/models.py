@@ -1,16 +1,74 @@
 import datetime
-import math
+import re
+from collections import Counter
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models, transaction
+from django.db.models.functions import ExtractIsoWeekDay, Now
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from model_clone.models import CloneModel
 
+from api import dateutils, stats
 
-class Marketplace(models.Model):
-    id = models.AutoField(primary_key=True)
 
+class SyncedQuerySet(models.QuerySet):
+    """Appends the rows touched by writes that bypass Model.save to the ChangeLog"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            ChangeLog.objects.record(
+                self.model._base_manager.filter(
+                    pk__in=[obj.pk for obj in created if obj.pk is not None]
+                )
+            )
+        return created
+
+    def update(self, **kwargs):
+        # QuerySet.update skips auto_now, bulk_update goes through here too
+        kwargs.setdefault("updated_at", Now())
+        with transaction.atomic(savepoint=False):
+            ChangeLog.objects.record(self)
+            return super().update(**kwargs)
+
+    def delete(self):
+        with transaction.atomic(savepoint=False):
+            ChangeLog.objects.record(self, deleted=True)
+            return super().delete()
+
+
+class SyncedModel(models.Model):
+    """Rows that clients mirror through /sync. sync_user is the lookup from the
+    model to its owner, deletes cascade to children without tombstones of
+    their own"""
+
+    sync_user = None
+
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
+
+    objects = SyncedQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+            ChangeLog.objects.record(type(self)._base_manager.filter(pk=self.pk))
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            ChangeLog.objects.record(
+                type(self)._base_manager.filter(pk=self.pk), deleted=True
+            )
+            return super().delete(*args, **kwargs)
+
+
+class Collection(SyncedModel, CloneModel):
+    sync_user = "user"
 
-class Collection(CloneModel):
     user = models.OneToOneField(
         User, related_name="collection", on_delete=models.CASCADE
     )
@@ -19,76 +77,334 @@ class Collection(CloneModel):
     threshold = models.IntegerField(default=75)
     start_date = models.DateField()
     end_date = models.DateField()
+    # Sessions exist for every day up to here, see generation.roll_sessions
+    generated_until = models.DateField(null=True, blank=True)
     _clone_fields = ["name", "threshold", "start_date", "end_date"]
     _clone_m2o_or_o2m_fields = ["courses"]
 
 
-class Course(CloneModel):
+class MarketplaceQuerySet(models.QuerySet):
+    def search(self, text):
+        """Listings whose name contains words starting with each word of text,
+        through the full text index on Postgres"""
+        words = re.findall(r"\w+", text.lower())
+        if not words:
+            return self
+        if connections[self.db].vendor != "postgresql":
+            return self.filter(*[models.Q(search_name__contains=word) for word in words])
+
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+
+        query = SearchQuery(
+            " & ".join(f"{word}:*" for word in words),
+            config="simple",
+            search_type="raw",
+        )
+        return self.annotate(document=SearchVector("name", config="simple")).filter(
+            document=query
+        )
+
+
+class MarketplaceManager(models.Manager.from_queryset(MarketplaceQuerySet)):
+    def sync(self, collection):
+        """Create, refresh or remove the listing of a collection to match it"""
+        if not collection.shared:
+            self.filter(collection=collection).delete()
+            return
+        self.update_or_create(
+            collection=collection,
+            defaults={
+                "name": collection.name,
+                "search_name": collection.name.lower(),
+                "course_count": collection.courses.count(),
+                "start_date": collection.start_date,
+                "end_date": collection.end_date,
+            },
+        )
+
+    def adopted(self, collection):
+        self.filter(collection=collection).update(
+            adopter_count=models.F("adopter_count") + 1
+        )
+
+
+class Marketplace(models.Model):
+    """Listing of a shared collection, carrying everything the marketplace
+    shows so listing pages never join into courses"""
+
+    collection = models.OneToOneField(
+        Collection, related_name="listing", on_delete=models.CASCADE
+    )
+    name = models.CharField(max_length=120)
+    # Lowercased name, indexed for prefix search
+    search_name = models.CharField(max_length=120, db_index=True)
+    course_count = models.IntegerField(default=0)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    adopter_count = models.IntegerField(default=0)
+
+    objects = MarketplaceManager()
+
+
+class HolidayQuerySet(models.QuerySet):
+    """Drops the cached holiday calendar on the writes that send no signals"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        transaction.on_commit(dateutils.invalidate_holidays)
+        return created
+
+    def update(self, **kwargs):
+        updated = super().update(**kwargs)
+        transaction.on_commit(dateutils.invalidate_holidays)
+        return updated
+
+
+class Holiday(models.Model):
+    """A non working day, applying to every collection when collection is null"""
+
+    date = models.DateField()
+    name = models.CharField(max_length=120, blank=True)
+    collection = models.ForeignKey(
+        Collection,
+        related_name="holidays",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+
+    objects = HolidayQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["collection", "date"], name="unique_collection_holiday"
+            ),
+            models.UniqueConstraint(
+                fields=["date"],
+                condition=models.Q(collection__isnull=True),
+                name="unique_global_holiday",
+            ),
+        ]
+
+
+@receiver([post_save, post_delete], sender=Holiday)
+def invalidate_holidays(sender, **kwargs):
+    # After commit, so other processes never cache the calendar being replaced
+    transaction.on_commit(dateutils.invalidate_holidays)
+
+
+class Course(SyncedModel, CloneModel):
+    sync_user = "collection__user"
+
     name = models.CharField(max_length=120)
     collection = models.ForeignKey(
         Collection, related_name="courses", on_delete=models.CASCADE
     )
     _clone_m2o_or_o2m_fields = ["schedules"]
 
+    def session_counts(self):
+        # Courses fetched through stats.with_stats already carry the counters
+        # as annotations, otherwise aggregate them in a single query
+        if not hasattr(self, "present_count"):
+            counts = self.sessions.aggregate(**stats.count_expressions())
+            for field in stats.COUNT_FIELDS:
+                setattr(self, field, counts[field])
+        return {field: getattr(self, field) for field in stats.COUNT_FIELDS}
+
+    def threshold(self):
+        if not hasattr(self, "collection_threshold"):
+            self.collection_threshold = self.collection.threshold
+        return self.collection_threshold
+
     def percentage(self):
-        present_count = self.sessions.filter(status="present").count()
-        bunked_count = self.sessions.filter(status="bunked").count()
-        if present_count == 0:
-            return 0
-        else:
-            return round(present_count / (present_count + bunked_count) * 100)
+        counts = self.session_counts()
+        return stats.percentage(counts["present_count"], counts["bunked_count"])
 
     def bunks_available(self):
-        total_sessions = self.sessions.exclude(status="cancelled").count()
-        must_attend = math.ceil((total_sessions * self.collection.threshold) / 100)
-        total_bunks_available = total_sessions - must_attend
-        bunked_sessions = self.sessions.filter(status="bunked").count()
-
-        return total_bunks_available - bunked_sessions
+        counts = self.session_counts()
+        return stats.bunks_available(
+            counts["active_count"], counts["bunked_count"], self.threshold()
+        )
 
     def current_percentage(self):
-        present_count = self.sessions.filter(
-            status="present", date__lte=datetime.date.today()
-        ).count()
-        bunked_count = self.sessions.filter(
-            status="bunked", date__lte=datetime.date.today()
-        ).count()
-        if present_count == 0:
-            return 0
-        else:
-            return round(present_count / (present_count + bunked_count) * 100)
+        counts = self.session_counts()
+        return stats.percentage(
+            counts["past_present_count"], counts["past_bunked_count"]
+        )
 
     def bunks_taken(self):
-        return self.sessions.filter(
-            status="bunked", date__lte=datetime.date.today()
-        ).count()
+        return self.session_counts()["past_bunked_count"]
 
     def classes_present(self):
-        return self.sessions.filter(
-            status="present", date__lte=datetime.date.today()
-        ).count()
+        return self.session_counts()["past_present_count"]
 
     def total_classes(self):
-        return self.sessions.filter(date__lte=datetime.date.today()).count()
+        return self.session_counts()["past_count"]
+
 
+class SessionQuerySet(SyncedQuerySet):
+    """Keeps AttendanceCounter in sync for writes that bypass Session.save"""
+
+    def lock_counters(self, course_ids):
+        # Serialize concurrent writers per course so the rebuild that follows
+        # always sees the other transaction's committed rows. Courses without
+        # a counter yet get a stale placeholder first, so there is a row to
+        # lock, a concurrent insert of the same row waits for this one
+        course_ids = set(course_ids)
+        AttendanceCounter.objects.bulk_create(
+            [
+                AttendanceCounter(course_id=course_id, as_of=datetime.date.min)
+                for course_id in course_ids
+            ],
+            ignore_conflicts=True,
+        )
+        list(
+            AttendanceCounter.objects.select_for_update().filter(
+                course_id__in=course_ids
+            )
+        )
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        course_ids = {obj.course_id for obj in objs}
+        with transaction.atomic():
+            self.lock_counters(course_ids)
+            self.assign_periods(objs)
+            created = super().bulk_create(objs, *args, **kwargs)
+            AttendanceCounter.objects.rebuild(course_ids)
+        return created
+
+    def update(self, **kwargs):
+        with transaction.atomic():
+            course_ids = set(self.values_list("course_id", flat=True).distinct())
+            self.lock_counters(course_ids)
+            updated = super().update(**kwargs)
+            course = kwargs.get("course", kwargs.get("course_id"))
+            if course is not None:
+                course_ids.add(getattr(course, "pk", course))
+            AttendanceCounter.objects.rebuild(course_ids)
+        return updated
+
+    def delete(self):
+        with transaction.atomic():
+            course_ids = set(self.values_list("course_id", flat=True).distinct())
+            self.lock_counters(course_ids)
+            deleted = super().delete()
+            AttendanceCounter.objects.rebuild(course_ids)
+        return deleted
+
+    def assign_periods(self, objs):
+        """Number the sessions without a period after the ones their course
+        already has on that date"""
+        pending = [obj for obj in objs if obj.period is None]
+        if not pending:
+            return
+        date_field = self.model._meta.get_field("date")
+        for obj in pending:
+            obj.date = date_field.to_python(obj.date)
+        latest = Counter(
+            {
+                (row["course_id"], row["date"]): row["period__max"]
+                for row in self.model._base_manager.filter(
+                    course_id__in={obj.course_id for obj in pending},
+                    date__in={obj.date for obj in pending},
+                )
+                .order_by()
+                .values("course_id", "date")
+                .annotate(models.Max("period"))
+            }
+        )
+        for obj in pending:
+            latest[obj.course_id, obj.date] += 1
+            obj.period = latest[obj.course_id, obj.date]
+
+
+class Session(SyncedModel):
+    sync_user = "course__collection__user"
 
-class Session(models.Model):
     status_choices = models.TextChoices("StatusChoices", "present bunked cancelled")
     course = models.ForeignKey(
-        Course, related_name="sessions", on_delete=models.CASCADE
+        Course, related_name="sessions", on_delete=models.CASCADE, db_index=False
     )
     date = models.DateField()
     status = models.TextField(choices=status_choices)
+    # Numbers the sessions of a course on one date, so two periods of the
+    # same course on a day are distinct rows of the unique constraint
+    period = models.PositiveSmallIntegerField()
+    # Matches Schedule.day_of_week, so a slot's sessions are an index range
+    weekday = models.GeneratedField(
+        expression=ExtractIsoWeekDay("date"),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+
+    objects = SessionQuerySet.as_manager()
+
+    class Meta:
+        # Every composite index leads with course, so the implicit
+        # single column foreign key index would only be redundant, the
+        # unique constraint doubles as the (course, date) index
+        constraints = [
+            models.UniqueConstraint(
+                fields=["course", "date", "period"], name="unique_session_period"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["course", "status", "date"], name="session_course_status_date"
+            ),
+            models.Index(
+                fields=["course", "date"],
+                condition=~models.Q(status="cancelled"),
+                name="session_course_date_active",
+            ),
+            models.Index(
+                fields=["course", "weekday", "date"], name="session_course_weekday_date"
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the loaded course so moving a session refreshes both counters
+        instance._loaded_course_id = instance.__dict__.get("course_id")
+        instance._loaded_date = instance.__dict__.get("date")
+        return instance
 
     # Choice fields are validated through model validation but django
     # doesnt enforce model validation on creation of new objects,
     # so we overwrite save to add validation functionality
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super().save(*args, **kwargs)
+        # A session moved to another course or date is numbered again there
+        if not self._state.adding and (
+            self.course_id != getattr(self, "_loaded_course_id", None)
+            or self.date != getattr(self, "_loaded_date", None)
+        ):
+            self.period = None
+        Session.objects.assign_periods([self])
+        # Both are computed by the database, unsaved rows have no value yet
+        self.full_clean(exclude=["updated_at", "weekday"])
+        course_ids = {self.course_id, getattr(self, "_loaded_course_id", None)}
+        course_ids.discard(None)
+        with transaction.atomic():
+            Session.objects.lock_counters(course_ids)
+            super().save(*args, **kwargs)
+            AttendanceCounter.objects.rebuild(course_ids)
+        self._loaded_course_id = self.course_id
+        self._loaded_date = self.date
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            Session.objects.lock_counters([self.course_id])
+            deleted = super().delete(*args, **kwargs)
+            AttendanceCounter.objects.rebuild([self.course_id])
+        return deleted
+
 
+class Schedule(SyncedModel):
+    sync_user = "course__collection__user"
 
-class Schedule(models.Model):
     class day_of_week_choices(models.IntegerChoices):
         MONDAY = 1, "monday"
         TUESDAY = 2, "tuesday"
@@ -104,3 +420,101 @@ class Schedule(models.Model):
     )
     day_of_week = models.IntegerField(choices=day_of_week_choices)
     order = models.IntegerField(default=1)
+
+
+class AttendanceCounterManager(models.Manager):
+    def rebuild(self, course_ids, today=None):
+        """Recount the sessions of the given courses and upsert their counters"""
+        course_ids = set(course_ids)
+        if not course_ids:
+            return
+        today = today or datetime.date.today()
+
+        counts = {
+            row.pop("course_id"): row
+            for row in Session.objects.filter(course_id__in=course_ids)
+            .order_by()
+            .values("course_id")
+            .annotate(**stats.counter_expressions(today))
+        }
+        counters = [
+            AttendanceCounter(
+                course_id=course_id,
+                as_of=today,
+                **counts.get(course_id, dict.fromkeys(stats.COUNTER_FIELDS, 0)),
+            )
+            for course_id in course_ids
+        ]
+        self.bulk_create(
+            counters,
+            update_conflicts=True,
+            unique_fields=["course"],
+            update_fields=["as_of", *stats.COUNTER_FIELDS],
+        )
+
+    def refresh(self, courses, today=None):
+        """Rebuild counters of the given courses that are missing or were
+        split into past and future on an earlier day"""
+        today = today or datetime.date.today()
+        stale = courses.exclude(counter__as_of=today).values_list("id", flat=True)
+        self.rebuild(stale, today)
+
+
+class AttendanceCounter(models.Model):
+    """Per course session totals, split into past (on or before as_of) and future"""
+
+    course = models.OneToOneField(
+        Course, related_name="counter", on_delete=models.CASCADE, primary_key=True
+    )
+    as_of = models.DateField()
+    past_present = models.IntegerField(default=0)
+    past_bunked = models.IntegerField(default=0)
+    past_cancelled = models.IntegerField(default=0)
+    future_present = models.IntegerField(default=0)
+    future_bunked = models.IntegerField(default=0)
+    future_cancelled = models.IntegerField(default=0)
+
+    objects = AttendanceCounterManager()
+
+
+class ChangeLogManager(models.Manager):
+    def record(self, queryset, deleted=False):
+        """Append an entry for every row of a SyncedModel queryset with a
+        single INSERT ... SELECT"""
+        model = queryset.model
+        try:
+            sql, params = (
+                queryset.order_by()
+                .values_list(f"{model.sync_user}_id", "pk")
+                .query.get_compiler(queryset.db)
+                .as_sql()
+            )
+        except EmptyResultSet:
+            return
+        connection = connections[queryset.db]
+        quote = connection.ops.quote_name
+        columns = ", ".join(
+            quote(column) for column in ["user_id", "object_id", "model", "deleted"]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(self.model._meta.db_table)} ({columns}) "
+                f"SELECT changed.*, %s, %s FROM ({sql}) changed",
+                [model._meta.model_name, deleted, *params],
+            )
+
+
+class ChangeLog(models.Model):
+    """Append only log of writes to synced rows, its id is the /sync cursor"""
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(db_default=Now())
+
+    objects = ChangeLogManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "id"], name="changelog_user_cursor")]
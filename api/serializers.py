@@ -1,17 +1,19 @@
-from collections import defaultdict
-
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
+from django.db import transaction
 from django.db.models import Max
 from rest_framework import serializers
 from rest_framework.reverse import reverse
 from rest_framework.serializers import ValidationError
 
-from api.models import Collection, Course, Schedule, Session
-from tasks.celery import create_sessions, create_sessions_schedule
+from api.generation import trim_sessions
+from api.metrics import TimedSerializerMixin
+from api.models import Collection, Course, Marketplace, Schedule, Session
+from api.timetable import apply_grid, create_grid
+from tasks.celery import request_sessions
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
 
     class Meta:
@@ -30,7 +32,7 @@ class UserSerializer(serializers.ModelSerializer):
         return User.objects.create_user(**validated_data)
 
 
-class ScheduleSerializer(serializers.ModelSerializer):
+class ScheduleSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     day_of_week = serializers.IntegerField(write_only=True)
     day_of_week_str = serializers.CharField(
         source="get_day_of_week_display", read_only=True
@@ -43,7 +45,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
         fields = ["day_of_week", "order", "day_of_week_str", "course_name", "date"]
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     schedules = ScheduleSerializer(write_only=True)
 
     class Meta:
@@ -62,13 +64,13 @@ class CourseSerializer(serializers.ModelSerializer):
             **schedule, order=(max_order + 1) if max_order else 1
         )
 
-        create_sessions_schedule.delay(
-            schedule.id, collection.start_date, collection.end_date
-        )
+        request_sessions(collection.id, schedule_ids=[schedule.id])
+        if collection.shared:
+            Marketplace.objects.sync(collection)
         return course
 
 
-class SessionSerializer(serializers.HyperlinkedModelSerializer):
+class SessionSerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     status = serializers.ChoiceField(choices=Session.status_choices, required=False)
     course = serializers.PrimaryKeyRelatedField(
         queryset=Course.objects.all(), write_only=True
@@ -87,7 +89,21 @@ class SessionSerializer(serializers.HyperlinkedModelSerializer):
         return course
 
 
-class CollectionSerializer(serializers.ModelSerializer):
+class SessionChangeSerializer(serializers.Serializer):
+    session_id = serializers.IntegerField(required=False)
+    course = serializers.IntegerField(required=False)
+    date = serializers.DateField(required=False)
+    status = serializers.ChoiceField(choices=Session.status_choices)
+
+    def validate(self, data):
+        if "session_id" not in data and not ("course" in data and "date" in data):
+            raise serializers.ValidationError(
+                "Either session_id or both course and date are required"
+            )
+        return data
+
+
+class CollectionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     shared = serializers.BooleanField(required=False)
     courses_data = serializers.ListField(write_only=True)
 
@@ -104,56 +120,46 @@ class CollectionSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         table_data = validated_data.pop("courses_data")
-        collection = Collection.objects.create(**validated_data)
-
-        # First nested list will have first period of each day
-        course_list = defaultdict(list)
-        for order, periods in enumerate(table_data, 1):
-            for day, period in enumerate(periods, 1):
-                if period != "":
-                    course_list[period].append((day, order))
-
-        for course in course_list:
-            created_course = collection.courses.create(name=course)
-            for schedule in course_list[course]:
-                created_course.schedules.create(
-                    day_of_week=schedule[0], order=schedule[1]
-                )
-
-        create_sessions.delay(collection.id, collection.start_date, collection.end_date)
+
+        with transaction.atomic():
+            collection = Collection.objects.create(**validated_data)
+            create_grid(collection, table_data)
+            if collection.shared:
+                Marketplace.objects.sync(collection)
+            # Every schedule is new, so the whole range is generated and
+            # generated_until tells clients when it is done
+            transaction.on_commit(lambda: request_sessions(collection.id))
         return collection
 
     def update(self, instance, validated_data):
         table_data = validated_data.pop("courses_data")
+        dates = (instance.start_date, instance.end_date)
 
         instance.name = validated_data.get("name", instance.name)
         instance.shared = validated_data.get("shared", instance.shared)
         instance.threshold = validated_data.get("threshold", instance.threshold)
         instance.start_date = validated_data.get("start_date", instance.start_date)
         instance.end_date = validated_data.get("end_date", instance.end_date)
-        instance.save()
-
-        # Since this is a collection level update, passing ID's would be a hassle
-        # Hence we delete all existing courses and rebuild them
-        instance.courses.all().delete()
-        course_list = defaultdict(list)
-        for order, periods in enumerate(table_data, 1):
-            for day, period in enumerate(periods, 1):
-                if period != "":
-                    course_list[period].append((day, order))
-
-        for course in course_list:
-            created_course = instance.courses.create(name=course)
-            for schedule in course_list[course]:
-                created_course.schedules.create(
-                    day_of_week=schedule[0], order=schedule[1]
-                )
-
-        create_sessions.delay(instance.id, instance.start_date, instance.end_date)
+        dates_changed = dates != (instance.start_date, instance.end_date)
+
+        # Only the courses and schedules that differ from the grid are written,
+        # so attendance marked on untouched slots is kept
+        with transaction.atomic():
+            instance.save()
+            created, removed_slots = apply_grid(instance, table_data)
+            Marketplace.objects.sync(instance)
+            trim_sessions(removed_slots)
+            if dates_changed:
+                Session.objects.filter(course__collection=instance).exclude(
+                    date__range=(instance.start_date, instance.end_date)
+                ).delete()
+
+        # New slots start after today, a date change regenerates the rest
+        request_sessions(instance.id, schedule_ids=created, whole_range=dates_changed)
         return instance
 
 
-class CollectionViewSerializer(serializers.ModelSerializer):
+class CollectionViewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     copy_id = serializers.IntegerField(write_only=True)
     name = serializers.CharField(read_only=True)
 
@@ -162,7 +168,23 @@ class CollectionViewSerializer(serializers.ModelSerializer):
         fields = ["name", "id", "copy_id"]
 
 
-class DateQuerySerializer(serializers.ModelSerializer):
+class MarketplaceSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # The collection id is what CollectionSelector takes as copy_id
+    id = serializers.IntegerField(source="collection_id", read_only=True)
+
+    class Meta:
+        model = Marketplace
+        fields = [
+            "id",
+            "name",
+            "course_count",
+            "start_date",
+            "end_date",
+            "adopter_count",
+        ]
+
+
+class DateQuerySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class SessionHyperlink(serializers.HyperlinkedIdentityField):
         def get_url(self, obj, view_name, request, format):
             url_kwargs = {
@@ -178,13 +200,13 @@ class DateQuerySerializer(serializers.ModelSerializer):
         fields = ["name", "status", "session_url"]
 
 
-class StatQuerySerializer(serializers.ModelSerializer):
+class StatQuerySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Course
         fields = ["name", "percentage", "bunks_available"]
 
 
-class CurrentStatSerializer(serializers.ModelSerializer):
+class CurrentStatSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Course
         fields = [
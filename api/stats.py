@@ -0,0 +1,105 @@
+import datetime
+import math
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, F, Q
+
+COUNT_FIELDS = [
+    "present_count",
+    "bunked_count",
+    "active_count",
+    "past_present_count",
+    "past_bunked_count",
+    "past_count",
+]
+
+COUNTER_FIELDS = [
+    "past_present",
+    "past_bunked",
+    "past_cancelled",
+    "future_present",
+    "future_bunked",
+    "future_cancelled",
+]
+
+
+def count_expressions(today=None, prefix=""):
+    """Conditional aggregates for every counter the stat figures are built from,
+    prefix is the lookup path from the queried model to Session"""
+    today = today or datetime.date.today()
+    field = f"{prefix}id"
+    status = f"{prefix}status"
+    past = {f"{prefix}date__lte": today}
+
+    return {
+        "present_count": Count(field, filter=Q(**{status: "present"})),
+        "bunked_count": Count(field, filter=Q(**{status: "bunked"})),
+        "active_count": Count(field, filter=~Q(**{status: "cancelled"})),
+        "past_present_count": Count(field, filter=Q(**{status: "present"}, **past)),
+        "past_bunked_count": Count(field, filter=Q(**{status: "bunked"}, **past)),
+        "past_count": Count(field, filter=Q(**past)),
+    }
+
+
+def counter_expressions(today=None, prefix=""):
+    """Conditional aggregates over Session for every AttendanceCounter column,
+    prefix is the lookup path from the queried model to Session"""
+    today = today or datetime.date.today()
+    field = f"{prefix}id"
+    expressions = {}
+    for status in ["present", "bunked", "cancelled"]:
+        status_filter = {f"{prefix}status": status}
+        expressions[f"past_{status}"] = Count(
+            field, filter=Q(**status_filter, **{f"{prefix}date__lte": today})
+        )
+        expressions[f"future_{status}"] = Count(
+            field, filter=Q(**status_filter, **{f"{prefix}date__gt": today})
+        )
+    return expressions
+
+
+def with_stats(courses, today=None):
+    """Annotate a Course queryset with all session counters, read from the
+    materialized AttendanceCounter rows instead of counting sessions"""
+    from api.models import AttendanceCounter
+
+    AttendanceCounter.objects.refresh(courses, today)
+    return _annotate_counters(courses)
+
+
+async def awith_stats(courses, today=None):
+    """with_stats for async views, the counter refresh runs in a thread"""
+    from api.models import AttendanceCounter
+
+    await sync_to_async(AttendanceCounter.objects.refresh)(courses, today)
+    return _annotate_counters(courses)
+
+
+def _annotate_counters(courses):
+    counter = {field: F(f"counter__{field}") for field in COUNTER_FIELDS}
+    present = counter["past_present"] + counter["future_present"]
+    bunked = counter["past_bunked"] + counter["future_bunked"]
+    return courses.annotate(
+        collection_threshold=F("collection__threshold"),
+        present_count=present,
+        bunked_count=bunked,
+        active_count=present + bunked,
+        past_present_count=counter["past_present"],
+        past_bunked_count=counter["past_bunked"],
+        past_count=(
+            counter["past_present"]
+            + counter["past_bunked"]
+            + counter["past_cancelled"]
+        ),
+    )
+
+
+def percentage(present_count, bunked_count):
+    if present_count == 0:
+        return 0
+    return round(present_count / (present_count + bunked_count) * 100)
+
+
+def bunks_available(active_count, bunked_count, threshold):
+    must_attend = math.ceil((active_count * threshold) / 100)
+    return active_count - must_attend - bunked_count
@@ -0,0 +1,92 @@
+import datetime
+
+from django.utils import timezone
+
+from api.models import ChangeLog, Collection, Course, Schedule, Session
+
+# Entries younger than this may still have lower ids committing behind them,
+# the cursor never moves past one so a slow transaction cannot be skipped
+SETTLE_TIME = datetime.timedelta(seconds=60)
+PAGE_SIZE = 1000
+
+SYNCED = {
+    "collection": (
+        Collection,
+        ["id", "name", "shared", "threshold", "start_date", "end_date", "updated_at"],
+    ),
+    "course": (Course, ["id", "collection_id", "name", "updated_at"]),
+    "schedule": (Schedule, ["id", "course_id", "day_of_week", "order", "updated_at"]),
+    "session": (Session, ["id", "course_id", "date", "status", "updated_at"]),
+}
+
+
+def _rows(user, name, **filters):
+    model, fields = SYNCED[name]
+    return list(
+        model.objects.filter(**{model.sync_user: user}, **filters)
+        .order_by("id")
+        .values(*fields)
+    )
+
+
+def snapshot(user):
+    """Every synced row of the user along with the cursor to sync from next"""
+    cursor = (
+        ChangeLog.objects.filter(
+            user=user, created_at__lt=timezone.now() - SETTLE_TIME
+        )
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    ) or 0
+    return {
+        "cursor": cursor,
+        "full": True,
+        "has_more": False,
+        "changed": {name: _rows(user, name) for name in SYNCED},
+        "deleted": {name: [] for name in SYNCED},
+    }
+
+
+def changes_since(user, since, page_size=PAGE_SIZE):
+    """The current state of the rows changed after the cursor and tombstones
+    for the deleted ones, a page of log entries at a time"""
+    # Cursors are ids of the user's own entries, one that is gone was purged
+    # with the entries after it, so the client starts over from a snapshot
+    if not ChangeLog.objects.filter(user=user, id=since).exists():
+        return snapshot(user)
+    entries = list(
+        ChangeLog.objects.filter(user=user, id__gt=since)
+        .order_by("id")
+        .values_list("id", "model", "object_id", "deleted", "created_at")[
+            : page_size + 1
+        ]
+    )
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+
+    settled = timezone.now() - SETTLE_TIME
+    cursor, advancing = since, True
+    latest = {name: {} for name in SYNCED}
+    for id, name, object_id, deleted, created_at in entries:
+        latest[name][object_id] = deleted
+        # Unsettled entries are sent again next time, applying them is idempotent
+        advancing = advancing and created_at < settled
+        if advancing:
+            cursor = id
+
+    changed, removed = {}, {}
+    for name, objects in latest.items():
+        live = [object_id for object_id, deleted in objects.items() if not deleted]
+        changed[name] = _rows(user, name, id__in=live) if live else []
+        # Rows that are gone without a tombstone were removed with their parent
+        found = {row["id"] for row in changed[name]}
+        removed[name] = sorted(set(objects) - found)
+
+    return {
+        "cursor": cursor,
+        "full": False,
+        "has_more": has_more and cursor > since,
+        "changed": changed,
+        "deleted": removed,
+    }
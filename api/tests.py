@@ -1,3 +1,1006 @@
-from django.test import TestCase
+import datetime
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from knox.models import AuthToken
+from rest_framework.test import APIClient
+
+from api import dateutils, stats
+from api.exports import export_csv, import_csv
+from api.generation import generate_requested, generate_sessions
+from api.management.commands import check_query_plans
+from api.models import (
+    AttendanceCounter,
+    ChangeLog,
+    Collection,
+    Course,
+    Holiday,
+    Schedule,
+    Session,
+)
+from api.serializers import CollectionSerializer
+from api.timetable import build_grid, create_grid
+from api.views import CalendarQuery
+from tasks.celery import (
+    _failed_key,
+    _finished_channel,
+    _pending_key,
+    _queued_key,
+    _redis,
+    _redis_url,
+    _running_key,
+    generate_pending_sessions,
+    generation_state,
+    wait_for_generation,
+)
+
+
+def make_collection(username, grid, weeks=4, generate=True):
+    """A user with a collection of the grid's courses over the weeks around
+    today, with its sessions generated"""
+    today = datetime.date.today()
+    collection = Collection.objects.create(
+        user=User.objects.create(username=username),
+        name=username,
+        start_date=today - datetime.timedelta(weeks=weeks),
+        end_date=today + datetime.timedelta(weeks=weeks),
+        threshold=75,
+    )
+    create_grid(collection, grid)
+    if generate:
+        generate_sessions(collection.id, collection.start_date, collection.end_date)
+    return collection
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": False})
+class StatQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        cls.user = User.objects.create(username="stats")
+        cls.collection = Collection.objects.create(
+            user=cls.user,
+            name="stats",
+            start_date=cls.today - datetime.timedelta(weeks=4),
+            end_date=cls.today + datetime.timedelta(weeks=4),
+            threshold=75,
+        )
+        create_grid(
+            cls.collection,
+            [
+                [f"course_{(day + order) % 7}" for day in range(5)]
+                for order in range(4)
+            ],
+        )
+        generate_sessions(
+            cls.collection.id, cls.collection.start_date, cls.collection.end_date
+        )
+        sessions = Session.objects.filter(course__collection=cls.collection)
+        for index, session in enumerate(sessions.order_by("id")):
+            if index % 5 == 0:
+                session.status = "bunked"
+            elif index % 7 == 0:
+                session.status = "cancelled"
+            else:
+                continue
+            session.save()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_statquery_query_count(self):
+        # Warm the counters, later requests only read them
+        self.client.get("/statquery")
+        # The collection, the stale counter check and the annotated courses
+        with self.assertNumQueries(3):
+            response = self.client.get("/statquery")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 7)
+
+    def test_current_query_count(self):
+        self.client.get("/current")
+        with self.assertNumQueries(3):
+            response = self.client.get("/current")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 7)
+
+    def test_query_count_does_not_grow_with_courses(self):
+        self.client.get("/statquery")
+        with self.assertNumQueries(3):
+            self.client.get("/statquery")
+        Course.objects.bulk_create(
+            Course(collection=self.collection, name=f"extra_{i}") for i in range(10)
+        )
+        self.client.get("/statquery")
+        with self.assertNumQueries(3):
+            response = self.client.get("/statquery")
+        self.assertEqual(len(response.data), 17)
+
+    def test_with_stats_matches_session_counts(self):
+        courses = stats.with_stats(Course.objects.filter(collection=self.collection))
+        for course in courses:
+            sessions = Session.objects.filter(course=course)
+            past = sessions.filter(date__lte=self.today)
+            present = sessions.filter(status="present").count()
+            bunked = sessions.filter(status="bunked").count()
+            active = sessions.exclude(status="cancelled").count()
+            with self.subTest(course=course.name):
+                self.assertEqual(course.present_count, present)
+                self.assertEqual(course.bunked_count, bunked)
+                self.assertEqual(course.active_count, active)
+                self.assertEqual(
+                    course.past_present_count, past.filter(status="present").count()
+                )
+                self.assertEqual(
+                    course.past_bunked_count, past.filter(status="bunked").count()
+                )
+                self.assertEqual(course.past_count, past.count())
+
+    def test_stat_figures_match_session_counts(self):
+        response = self.client.get("/statquery")
+        current = {row["name"]: row for row in self.client.get("/current").data}
+        for row in response.data:
+            sessions = Session.objects.filter(
+                course__collection=self.collection, course__name=row["name"]
+            )
+            past = sessions.filter(date__lte=self.today)
+            present = sessions.filter(status="present").count()
+            bunked = sessions.filter(status="bunked").count()
+            active = sessions.exclude(status="cancelled").count()
+            past_present = past.filter(status="present").count()
+            past_bunked = past.filter(status="bunked").count()
+            with self.subTest(course=row["name"]):
+                self.assertEqual(row["percentage"], stats.percentage(present, bunked))
+                self.assertEqual(
+                    row["bunks_available"], stats.bunks_available(active, bunked, 75)
+                )
+                self.assertEqual(
+                    current[row["name"]],
+                    {
+                        "name": row["name"],
+                        "current_percentage": stats.percentage(
+                            past_present, past_bunked
+                        ),
+                        "bunks_taken": past_bunked,
+                        "classes_present": past_present,
+                        "total_classes": past.count(),
+                    },
+                )
+
+
+def request_sessions_now(
+    collection_id, schedule_ids=None, bulk=False, whole_range=None
+):
+    """Stands in for tasks.celery.request_sessions, generating right away"""
+    if whole_range is None:
+        whole_range = schedule_ids is None
+    generate_requested(collection_id, list(schedule_ids or []), whole_range)
+
+
+@mock.patch("api.serializers.request_sessions", request_sessions_now)
+class TimetableEditTests(TestCase):
+    grid = [["A", "B", "C", "D", "E"], ["B", "A", "", "D", "E"]]
+
+    def setUp(self):
+        self.today = datetime.date.today()
+        self.collection = make_collection("editor", self.grid)
+
+    def edit(self, grid, **fields):
+        data = {
+            "name": self.collection.name,
+            "start_date": self.collection.start_date,
+            "end_date": self.collection.end_date,
+            "threshold": self.collection.threshold,
+            **fields,
+            "courses_data": grid,
+        }
+        serializer = CollectionSerializer(self.collection, data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.collection.refresh_from_db()
+
+    def sessions(self, name, weekday, past):
+        sessions = Session.objects.filter(
+            course__collection=self.collection, course__name=name, weekday=weekday
+        )
+        if past:
+            return sessions.filter(date__lte=self.today)
+        return sessions.filter(date__gt=self.today)
+
+    def test_rename_keeps_marked_sessions(self):
+        course = Course.objects.get(collection=self.collection, name="A")
+        marked = self.sessions("A", 1, past=True).first()
+        marked.status = "bunked"
+        marked.save()
+        count = Session.objects.filter(course=course).count()
+
+        self.edit([["Alpha", "B", "C", "D", "E"], ["B", "Alpha", "", "D", "E"]])
+        course.refresh_from_db()
+        self.assertEqual(course.name, "Alpha")
+        self.assertEqual(Session.objects.filter(course=course).count(), count)
+        self.assertEqual(Session.objects.get(id=marked.id).status, "bunked")
+
+    def test_moved_slot_generates_only_after_today(self):
+        past_tuesdays = self.sessions("A", 2, past=True).count()
+        # A moves from tuesday to wednesday
+        self.edit([["A", "B", "C", "D", "E"], ["B", "", "A", "D", "E"]])
+        self.assertEqual(self.sessions("A", 2, past=True).count(), past_tuesdays)
+        self.assertFalse(self.sessions("A", 2, past=False).exists())
+        self.assertFalse(self.sessions("A", 3, past=True).exists())
+        self.assertEqual(self.sessions("A", 3, past=False).count(), 4)
+
+    def test_removed_period_trims_only_future_sessions(self):
+        self.edit([["A", "B", "C", "D", "E"], ["A", "A", "", "D", "E"]])
+        past = self.sessions("A", 1, past=True).count()
+        self.assertEqual(self.sessions("A", 1, past=False).count(), 8)
+
+        self.edit([["A", "B", "C", "D", "E"], ["B", "A", "", "D", "E"]])
+        self.assertEqual(self.sessions("A", 1, past=True).count(), past)
+        future = self.sessions("A", 1, past=False)
+        self.assertEqual(future.count(), 4)
+        self.assertEqual(set(future.values_list("period", flat=True)), {1})
+
+    def test_date_change_regenerates_other_schedules(self):
+        start_date = self.collection.start_date - datetime.timedelta(weeks=2)
+        # F is added to monday in the same edit
+        self.edit([*self.grid, ["F", "", "", "", ""]], start_date=start_date)
+        early = Session.objects.filter(
+            course__collection=self.collection,
+            date__lt=start_date + datetime.timedelta(weeks=2),
+        )
+        self.assertEqual(early.filter(course__name="A").count(), 4)
+        self.assertEqual(early.filter(course__name="D").count(), 4)
+        self.assertFalse(self.sessions("F", 1, past=True).exists())
+        self.assertEqual(self.sessions("F", 1, past=False).count(), 4)
+
+
+class AttendanceCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        cls.collection = make_collection(
+            "counters", [["A", "B", "A", "B", "C"], ["B", "C", "", "", "A"]]
+        )
+
+    def assertCountersMatch(self):
+        courses = Course.objects.filter(collection=self.collection)
+        for course in courses:
+            counter = AttendanceCounter.objects.get(course=course)
+            sessions = Session.objects.filter(course=course)
+            with self.subTest(course=course.name):
+                for status in ["present", "bunked", "cancelled"]:
+                    of_status = sessions.filter(status=status)
+                    self.assertEqual(
+                        getattr(counter, f"past_{status}"),
+                        of_status.filter(date__lte=self.today).count(),
+                    )
+                    self.assertEqual(
+                        getattr(counter, f"future_{status}"),
+                        of_status.filter(date__gt=self.today).count(),
+                    )
+
+    def test_generated_sessions(self):
+        self.assertCountersMatch()
+
+    def test_bulk_create(self):
+        course = Course.objects.get(collection=self.collection, name="C")
+        Session.objects.bulk_create(
+            Session(
+                course=course,
+                date=self.today + datetime.timedelta(days=days),
+                status=status,
+            )
+            for days, status in [(-2, "bunked"), (-1, "cancelled"), (3, "present")]
+        )
+        self.assertCountersMatch()
+
+    def test_queryset_update(self):
+        sessions = Session.objects.filter(course__collection=self.collection)
+        sessions.filter(course__name="A").update(status="bunked")
+        sessions.filter(course__name="B", date__gt=self.today).update(
+            status="cancelled"
+        )
+        self.assertCountersMatch()
+
+    def test_queryset_delete(self):
+        Session.objects.filter(
+            course__collection=self.collection, course__name="B", date__lte=self.today
+        ).delete()
+        self.assertCountersMatch()
+
+    def test_first_write_creates_the_counter(self):
+        course = Course.objects.create(collection=self.collection, name="D")
+        self.assertFalse(AttendanceCounter.objects.filter(course=course).exists())
+        Session.objects.create(course=course, date=self.today, status="bunked")
+        self.assertEqual(AttendanceCounter.objects.get(course=course).past_bunked, 1)
+        self.assertCountersMatch()
+
+    @override_settings(RESPONSE_CACHE={"ENABLED": False})
+    def test_batch_attendance(self):
+        sessions = Session.objects.filter(course__collection=self.collection)
+        past = sessions.filter(course__name="A", date__lte=self.today)[:5]
+        future = sessions.filter(course__name="B", date__gt=self.today).first()
+        client = APIClient()
+        client.force_authenticate(self.collection.user)
+        changes = [{"session_id": session.id, "status": "bunked"} for session in past]
+        changes.append(
+            {"course": future.course_id, "date": future.date, "status": "cancelled"}
+        )
+        response = client.post("/sessions/batch", {"changes": changes}, format="json")
+        self.assertEqual(response.data["updated_count"], 6)
+        self.assertCountersMatch()
+
+
+@override_settings(
+    RESPONSE_CACHE={"ENABLED": True, "TIMEOUT": 60},
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        cls.collection = make_collection("cached", [["A", "B", "C", "D", "E"]])
+        cls.user = cls.collection.user
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertCache(self, path, expected, client=None):
+        response = (client or self.client).get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Cache"], expected, path)
+        return response
+
+    def test_second_get_is_a_hit(self):
+        for path in ["/statquery", "/current", "/collection"]:
+            first = self.assertCache(path, "MISS")
+            second = self.assertCache(path, "HIT")
+            self.assertEqual(first.data, second.data)
+
+    def test_session_patch_invalidates(self):
+        self.assertCache("/statquery", "MISS")
+        self.assertCache("/statquery", "HIT")
+        session = Session.objects.filter(course__collection=self.collection).first()
+        response = self.client.patch(
+            f"/session/{session.id}", {"status": "bunked"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertCache("/statquery", "MISS")
+
+    def test_bulk_cancel_invalidates(self):
+        self.assertCache("/current", "MISS")
+        self.assertCache("/current", "HIT")
+        response = self.client.post(
+            "/bulk_cancel",
+            {"start_date": self.today.isoformat(), "end_date": self.today.isoformat()},
+            format="json",
+        )
+        self.assertLess(response.status_code, 400)
+        self.assertCache("/current", "MISS")
+
+    def test_failed_writes_keep_the_cache(self):
+        self.assertCache("/statquery", "MISS")
+        response = self.client.patch(
+            "/session/0", {"status": "bunked"}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertCache("/statquery", "HIT")
+
+    def test_users_do_not_share_entries(self):
+        other = make_collection("cached_other", [["E", "D", "C", "B", "A"]])
+        client = APIClient()
+        client.force_authenticate(other.user)
+        self.assertCache("/collection", "MISS")
+        self.assertCache("/collection", "HIT")
+        response = self.assertCache("/collection", "MISS", client)
+        self.assertEqual(response.data["courses_data"], [["E", "D", "C", "B", "A"]])
+        self.assertCache("/collection", "HIT", client)
+
+
+class HolidayCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The holidays created here are rolled back without a signal, so the
+        # process cache is dropped once the class is done
+        cls.addClassCleanup(dateutils.invalidate_holidays)
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username="holidays")
+        cls.collection = Collection.objects.create(
+            user=user, name="holidays", start_date="2024-01-01", end_date="2024-06-28"
+        )
+        cls.new_year = datetime.date(2024, 1, 1)
+        Holiday.objects.create(date=cls.new_year)
+
+    def test_collection_holidays_are_added_to_the_global_ones(self):
+        own = datetime.date(2024, 3, 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Holiday.objects.create(date=own, collection=self.collection)
+        self.assertTrue(dateutils.is_holiday(self.new_year))
+        self.assertFalse(dateutils.is_holiday(own))
+        self.assertTrue(dateutils.is_holiday(own, self.collection.id))
+        self.assertTrue(dateutils.is_holiday(self.new_year, self.collection.id))
+
+    def test_saved_holidays_invalidate_the_cache(self):
+        date = datetime.date(2024, 4, 1)
+        self.assertFalse(dateutils.is_holiday(date, self.collection.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            holiday = Holiday.objects.create(date=date)
+        self.assertTrue(dateutils.is_holiday(date, self.collection.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            holiday.delete()
+        self.assertFalse(dateutils.is_holiday(date, self.collection.id))
+
+    def test_bulk_writes_invalidate_the_cache(self):
+        dates = [datetime.date(2024, 4, 1), datetime.date(2024, 4, 2)]
+        self.assertFalse(dateutils.is_holiday(dates[0], self.collection.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            Holiday.objects.bulk_create(
+                Holiday(date=date, collection=self.collection) for date in dates
+            )
+        self.assertTrue(dateutils.is_holiday(dates[0], self.collection.id))
+
+        moved = datetime.date(2024, 4, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Holiday.objects.filter(date=dates[1]).update(date=moved)
+        self.assertFalse(dateutils.is_holiday(dates[1], self.collection.id))
+        self.assertTrue(dateutils.is_holiday(moved, self.collection.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Holiday.objects.filter(collection=self.collection).delete()
+        self.assertFalse(dateutils.is_holiday(moved, self.collection.id))
+
+    def test_collection_cache_is_bounded(self):
+        for collection_id in range(dateutils.HOLIDAY_CACHE_COLLECTIONS + 10):
+            dateutils.holiday_ordinals(collection_id)
+        self.assertEqual(
+            len(dateutils._collection_holidays), dateutils.HOLIDAY_CACHE_COLLECTIONS
+        )
+
+
+@override_settings(
+    AUTH_CACHE={"ENABLED": True, "TIMEOUT": 60},
+    RESPONSE_CACHE={"ENABLED": False},
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class CachedTokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = make_collection("auth", [["A", "B", "C", "D", "E"]])
+        cls.user = cls.collection.user
+
+    def setUp(self):
+        cache.clear()
+
+    def client_for(self, expiry=None):
+        _, token = AuthToken.objects.create(self.user, expiry=expiry)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {token}")
+        return client
+
+    def test_cached_token_costs_one_query(self):
+        client = self.client_for()
+        self.assertEqual(client.get("/schedules").status_code, 200)
+        # The user by id, then the collection and its schedules
+        with self.assertNumQueries(3):
+            self.assertEqual(client.get("/schedules").status_code, 200)
+
+    def test_logout_revokes_the_cached_token(self):
+        client = self.client_for()
+        self.assertEqual(client.get("/schedules").status_code, 200)
+        self.assertEqual(client.post("/logout").status_code, 200)
+        self.assertEqual(client.get("/schedules").status_code, 401)
+
+    def test_expired_token_in_the_cache(self):
+        client = self.client_for(expiry=datetime.timedelta(hours=1))
+        self.assertEqual(client.get("/schedules").status_code, 200)
+        later = timezone.now() + datetime.timedelta(hours=2)
+        with mock.patch("api.auth.timezone.now", return_value=later):
+            self.assertEqual(client.get("/schedules").status_code, 401)
+
+    def test_deactivated_user(self):
+        client = self.client_for()
+        self.assertEqual(client.get("/schedules").status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(client.get("/schedules").status_code, 401)
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": False})
+class CollectionSelectorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="adopter")
+        cls.own = Collection.objects.create(
+            user=cls.user, name="own", start_date="2024-01-01", end_date="2024-06-28"
+        )
+        cls.template = Collection.objects.create(
+            user=User.objects.create(username="owner"),
+            name="template",
+            start_date=datetime.date(2024, 1, 1),
+            end_date=datetime.date(2024, 6, 28),
+        )
+        create_grid(cls.template, [["A", "B", "C", "D", "E"]])
+        generate_sessions(
+            cls.template.id, cls.template.start_date, cls.template.end_date
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_private_collections_cannot_be_copied(self):
+        response = self.client.post(
+            "/collection_selector", {"copy_id": self.template.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Collection.objects.filter(id=self.own.id).exists())
+
+    def test_shared_collections_are_copied(self):
+        Collection.objects.filter(id=self.template.id).update(shared=True)
+        response = self.client.post(
+            "/collection_selector", {"copy_id": self.template.id}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        copy = Collection.objects.get(user=self.user)
+        self.assertNotEqual(copy.id, self.own.id)
+        self.assertEqual(
+            Session.objects.filter(course__collection=copy).count(),
+            Session.objects.filter(course__collection=self.template).count(),
+        )
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": False})
+class CollectionGridTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="grid")
+        cls.collection = Collection.objects.create(
+            user=cls.user, name="grid", start_date="2024-01-01", end_date="2024-06-28"
+        )
+        cls.grid = [
+            ["A", "B", "C", "D", "E"],
+            ["B", "A", "", "D", "E"],
+            ["C", "", "A", "", ""],
+            ["", "", "", "F", ""],
+        ]
+        create_grid(cls.collection, cls.grid)
+
+    def test_build_grid_is_one_query(self):
+        with self.assertNumQueries(1):
+            grid = build_grid(self.collection)
+        self.assertEqual(grid, self.grid)
+
+    def test_query_count_does_not_grow_with_periods(self):
+        collection = Collection.objects.create(
+            user=User.objects.create(username="grid_large"),
+            name="grid",
+            start_date="2024-01-01",
+            end_date="2024-06-28",
+        )
+        grid = [
+            [f"course_{(day + order) % 10}" for day in range(5)] for order in range(12)
+        ]
+        create_grid(collection, grid)
+        with self.assertNumQueries(1):
+            self.assertEqual(build_grid(collection), grid)
+
+    def test_collection_view_query_count(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # The collection and the grid
+        with self.assertNumQueries(2):
+            response = client.get("/collection")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["courses_data"], self.grid)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "Query plans need Postgres")
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        cls.collections = check_query_plans.seed(100, cls.today)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def test_hot_queries_use_indexes(self):
+        queries = check_query_plans.hot_queries(self.collections[0], self.today)
+        for name, queryset in queries.items():
+            with self.subTest(query=name):
+                plan = queryset.explain()
+                self.assertNotIn("Seq Scan", plan, f"{name}:\n{plan}")
+
+
+@unittest.skipUnless(_redis_url(), "generation runs are only tracked in redis")
+class GenerationTaskTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = make_collection("tasks", [["A"]], generate=False)
+
+    def setUp(self):
+        self.redis = _redis()
+        keys = [
+            key(self.collection.id)
+            for key in [_failed_key, _pending_key, _queued_key, _running_key]
+        ]
+        self.addCleanup(self.redis.delete, *keys)
+        patcher = mock.patch("api.generation.generate_requested", return_value=0)
+        self.generate = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_task(self):
+        return generate_pending_sessions.apply((self.collection.id,))
+
+    def test_pending_requests_are_merged(self):
+        self.redis.sadd(_pending_key(self.collection.id), 3, 5, "all")
+        self.run_task()
+        self.generate.assert_called_once_with(self.collection.id, [3, 5], True)
+        self.assertEqual(generation_state(self.collection.id), "done")
+        self.run_task()
+        self.generate.assert_called_once()
+
+    def test_overlapping_runs_keep_the_running_marker(self):
+        running = _running_key(self.collection.id)
+        self.redis.sadd(running, "other")
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(_finished_channel(self.collection.id))
+        self.addCleanup(pubsub.close)
+
+        self.run_task()
+        self.redis.sadd(_pending_key(self.collection.id), "all")
+        self.run_task()
+        self.assertEqual(generation_state(self.collection.id), "running")
+        self.assertIsNone(pubsub.get_message(timeout=0.1))
+
+        self.redis.srem(running, "other")
+        self.redis.sadd(_pending_key(self.collection.id), "all")
+        self.run_task()
+        self.assertEqual(generation_state(self.collection.id), "done")
+        self.assertIsNotNone(pubsub.get_message(timeout=1))
+
+    def test_failed_run_is_retried(self):
+        self.generate.side_effect = RuntimeError
+        self.redis.sadd(_pending_key(self.collection.id), 3, "all")
+        with mock.patch.object(generate_pending_sessions, "retry", side_effect=Retry):
+            self.assertEqual(self.run_task().state, "RETRY")
+        self.assertEqual(
+            self.redis.smembers(_pending_key(self.collection.id)), {b"3", b"all"}
+        )
+        self.assertEqual(generation_state(self.collection.id), "pending")
+
+    def test_exhausted_retries_report_failed(self):
+        self.generate.side_effect = RuntimeError
+        self.redis.sadd(_pending_key(self.collection.id), "all")
+        with self.assertLogs("celery.app.trace", "ERROR"):
+            result = generate_pending_sessions.apply(
+                (self.collection.id,), retries=generate_pending_sessions.max_retries
+            )
+        self.assertTrue(result.failed())
+        self.assertEqual(generation_state(self.collection.id), "failed")
+        self.assertEqual(wait_for_generation(self.collection.id, 5), "failed")
+
+        self.generate.side_effect = None
+        self.redis.sadd(_pending_key(self.collection.id), "all")
+        self.run_task()
+        self.assertEqual(generation_state(self.collection.id), "done")
+
+
+class SyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="sync")
+        cls.collection = Collection.objects.create(
+            user=cls.user,
+            name="sync",
+            start_date=datetime.date(2024, 1, 1),
+            end_date=datetime.date(2024, 6, 28),
+        )
+        create_grid(cls.collection, [["A", "B", "C", "D", "E"]])
+
+    def test_generation_logs_only_inserted_sessions(self):
+        dates = (self.collection.start_date, self.collection.end_date)
+        inserted = generate_sessions(self.collection.id, *dates)
+        logged = ChangeLog.objects.filter(user=self.user, model="session")
+        self.assertEqual(logged.count(), inserted)
+        self.assertEqual(generate_sessions(self.collection.id, *dates), 0)
+        self.assertEqual(logged.count(), inserted)
+
+        Session.objects.filter(
+            course__collection=self.collection, date=dates[0]
+        ).delete()
+        before = logged.count()
+        self.assertEqual(generate_sessions(self.collection.id, *dates), 1)
+        self.assertEqual(logged.count(), before + 1)
+
+    def test_purged_cursor_gets_a_snapshot(self):
+        from tasks.celery import purge_changelog
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        cursor = ChangeLog.objects.filter(user=self.user).latest("id").id
+        self.assertFalse(client.get(f"/sync?since={cursor}").data["full"])
+
+        ChangeLog.objects.update(
+            created_at=timezone.now() - datetime.timedelta(days=365)
+        )
+        purge_changelog()
+        self.assertFalse(ChangeLog.objects.exists())
+        response = client.get(f"/sync?since={cursor}")
+        self.assertTrue(response.data["full"])
+        self.assertEqual(len(response.data["changed"]["course"]), 5)
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": False})
+class ScheduleDestroyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        cls.collection = make_collection(
+            "schedules", [["A", "B", "C", "D", "E"], ["A", "", "", "", "B"]]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.collection.user)
+
+    def sessions(self, name, weekday):
+        return Session.objects.filter(
+            course__collection=self.collection, course__name=name, weekday=weekday
+        )
+
+    def delete(self, name, day_of_week, order):
+        schedule = Schedule.objects.get(
+            course__collection=self.collection,
+            course__name=name,
+            day_of_week=day_of_week,
+            order=order,
+        )
+        response = self.client.delete(f"/schedule/{schedule.id}")
+        self.assertEqual(response.status_code, 204)
+
+    def test_one_of_two_periods_on_a_day(self):
+        past = self.sessions("A", 1).filter(date__lte=self.today)
+        before = past.count()
+        past.filter(period=2).update(status="bunked")
+        self.delete("A", 1, 2)
+
+        self.assertEqual(past.count(), before)
+        self.assertEqual(past.filter(status="bunked").count(), before // 2)
+        future = self.sessions("A", 1).filter(date__gt=self.today)
+        self.assertTrue(future.exists())
+        self.assertFalse(future.filter(period=2).exists())
+
+    def test_one_of_two_days(self):
+        tuesdays = self.sessions("B", 2).count()
+        fridays = self.sessions("B", 5)
+        past = fridays.filter(date__lte=self.today).count()
+        self.delete("B", 5, 2)
+
+        self.assertEqual(self.sessions("B", 2).count(), tuesdays)
+        self.assertEqual(fridays.count(), past)
+
+    def test_last_schedule_deletes_the_course(self):
+        self.delete("C", 3, 1)
+        self.assertFalse(
+            Course.objects.filter(collection=self.collection, name="C").exists()
+        )
+        self.assertFalse(self.sessions("C", 3).exists())
+        self.assertTrue(self.sessions("D", 4).exists())
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": False})
+class CalendarQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = make_collection(
+            "calendar", [["A", "B", "C", "D", "E"], ["B", "", "", "", "A"]]
+        )
+        cls.start = datetime.date.today() - datetime.timedelta(days=14)
+        cls.end = cls.start + datetime.timedelta(days=27)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.collection.user)
+
+    def get(self, start=None, end=None, **headers):
+        start, end = start or self.start, end or self.end
+        return self.client.get(f"/calendar?start={start}&end={end}", **headers)
+
+    def test_range_is_limited(self):
+        end = self.start + datetime.timedelta(days=CalendarQuery.max_days - 1)
+        self.assertEqual(self.get(end=end).status_code, 200)
+        too_long = self.get(end=end + datetime.timedelta(days=1))
+        self.assertEqual(too_long.status_code, 400)
+        self.assertEqual(self.get(self.end, self.start).status_code, 400)
+        self.assertEqual(self.client.get("/calendar").status_code, 400)
+
+    def test_sessions_are_grouped_by_date(self):
+        days = self.get().data["days"]
+        self.assertEqual(len(days), 28)
+        sessions = Session.objects.filter(
+            course__collection=self.collection, date__range=(self.start, self.end)
+        )
+        names = sessions.values_list("course__name", flat=True)
+        for date, entries in days.items():
+            with self.subTest(date=date):
+                self.assertEqual(
+                    sorted(entry["name"] for entry in entries),
+                    sorted(names.filter(date=date)),
+                )
+        monday = self.start + datetime.timedelta(days=7 - self.start.weekday())
+        self.assertEqual(len(days[monday.isoformat()]), 2)
+        saturday = monday + datetime.timedelta(days=5)
+        self.assertEqual(days[saturday.isoformat()], [])
+
+    def test_not_modified(self):
+        response = self.get()
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304
+        )
+        self.assertEqual(
+            self.get(HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]).status_code, 304
+        )
+
+    def test_writes_change_the_etag(self):
+        etag = self.get()["ETag"]
+        sessions = Session.objects.filter(
+            course__collection=self.collection, date__range=(self.start, self.end)
+        )
+        session = sessions.first()
+        session.status = "bunked"
+        session.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        sessions.filter(id=session.id).delete()
+        self.assertNotEqual(self.get()["ETag"], etag)
+
+
+@override_settings(RESPONSE_CACHE={"ENABLED": False})
+class BatchAttendanceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = make_collection("batch", [["A", "B", "C", "D", "E"]])
+        cls.other = make_collection("batch_other", [["A", "B", "C", "D", "E"]])
+        cls.session = Session.objects.filter(course__collection=cls.collection)[0]
+        cls.foreign = Session.objects.filter(course__collection=cls.other)[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.collection.user)
+
+    def post(self, data):
+        return self.client.post("/sessions/batch", data, format="json")
+
+    def test_per_item_results(self):
+        response = self.post(
+            {
+                "changes": [
+                    {"session_id": self.session.id, "status": "bunked"},
+                    {"session_id": self.foreign.id, "status": "bunked"},
+                    {"session_id": self.session.id, "status": "skipped"},
+                ]
+            }
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["updated_count"], 1)
+        results = response.data["results"]
+        self.assertEqual(results[0]["result"], "ok")
+        self.assertEqual(results[0]["sessions"], [self.session.id])
+        self.assertEqual(results[1]["result"], "not_found")
+        self.assertEqual(results[2]["result"], "invalid")
+        self.assertIn("status", results[2]["errors"])
+        self.session.refresh_from_db()
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.session.status, "bunked")
+        self.assertEqual(self.foreign.status, "present")
+
+    def test_change_by_course_and_date(self):
+        response = self.post(
+            {
+                "changes": [
+                    {
+                        "course": self.session.course_id,
+                        "date": self.session.date.isoformat(),
+                        "status": "cancelled",
+                    }
+                ]
+            }
+        )
+        self.assertEqual(response.data["results"][0]["sessions"], [self.session.id])
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.status, "cancelled")
+
+    def test_rejects_more_than_max_changes(self):
+        change = {"session_id": self.session.id, "status": "bunked"}
+        self.assertEqual(self.post({"changes": [change] * 500}).status_code, 200)
+        self.assertEqual(self.post({"changes": [change] * 501}).status_code, 400)
+
+    def test_rejects_non_list_bodies(self):
+        for data in [[], {"changes": []}, {"changes": {"session_id": 1}}]:
+            with self.subTest(data=data):
+                self.assertEqual(self.post(data).status_code, 400)
+
+
+class CsvImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.collection = make_collection("csv", [["A", "A", "B", "", "C"]])
+        cls.sessions = Session.objects.filter(course__collection=cls.collection)
+
+    def exported(self):
+        return list(export_csv([self.collection]))
+
+    def test_reimport_updates_in_place(self):
+        before = self.sessions.count()
+        lines = self.exported()
+        self.assertEqual(import_csv(lines, self.collection), before)
+        self.assertEqual(import_csv(lines, self.collection), before)
+        self.assertEqual(self.sessions.count(), before)
+
+        lines[1:] = [line.replace(",present", ",bunked") for line in lines[1:]]
+        import_csv(lines, self.collection)
+        self.assertEqual(self.sessions.count(), before)
+        self.assertFalse(self.sessions.filter(status="present").exists())
+
+    def test_round_trip_into_another_collection(self):
+        lines = self.exported()
+        target = make_collection("csv_target", [], generate=False)
+        imported = Session.objects.filter(course__collection=target)
+        for _ in range(2):
+            import_csv(lines, target)
+            self.assertEqual(imported.count(), self.sessions.count())
+        self.assertEqual(
+            set(imported.values_list("course__name", "date", "period", "status")),
+            set(self.sessions.values_list("course__name", "date", "period", "status")),
+        )
+
+    def test_files_without_periods(self):
+        lines = [
+            "collection,course,date,status\r\n",
+            "csv,A,2024-01-01,present\r\n",
+            "csv,A,2024-01-01,bunked\r\n",
+        ]
+        for _ in range(2):
+            import_csv(lines, self.collection)
+        self.assertEqual(
+            list(
+                self.sessions.filter(date="2024-01-01")
+                .order_by("period")
+                .values_list("period", "status")
+            ),
+            [(1, "present"), (2, "bunked")],
+        )
+
+
+class AnonymousAccessTests(TestCase):
+    def assertRequiresLogin(self, method, path):
+        response = getattr(APIClient(), method)(path)
+        self.assertEqual(response.status_code, 401, path)
+
+    def test_export(self):
+        self.assertRequiresLogin("get", "/export/csv")
+
+    def test_batch_attendance(self):
+        self.assertRequiresLogin("post", "/sessions/batch")
+
+    def test_calendar(self):
+        self.assertRequiresLogin("get", "/calendar")
+
+    def test_generation_status(self):
+        self.assertRequiresLogin("get", "/generation_status")
+
+    def test_sync(self):
+        self.assertRequiresLogin("get", "/sync")
@@ -0,0 +1,213 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+from api.models import (
+    AttendanceCounter,
+    ChangeLog,
+    Collection,
+    Course,
+    Holiday,
+    Marketplace,
+    Schedule,
+    Session,
+)
+
+
+def parse_grid(table_data):
+    """Map each course name to its set of (day_of_week, order) slots"""
+    # First nested list will have first period of each day
+    slots = defaultdict(set)
+    for order, periods in enumerate(table_data, 1):
+        for day, period in enumerate(periods, 1):
+            if period != "":
+                slots[period].add((day, order))
+    return slots
+
+
+def grid_slots(collection):
+    return (
+        Schedule.objects.filter(course__collection=collection)
+        .order_by("day_of_week", "order", "id")
+        .values_list("day_of_week", "order", "course__name")
+    )
+
+
+def build_grid(collection):
+    """Render a collection's schedules as a courses_data grid with one query,
+    the inverse of parse_grid"""
+    return render_grid(list(grid_slots(collection)))
+
+
+async def abuild_grid(collection):
+    return render_grid([slot async for slot in grid_slots(collection)])
+
+
+def render_grid(slots):
+    max_order = max((order for _, order, _ in slots), default=1)
+    # First nested list is the first period of each day, second nested list is second period of each day
+    grid = [[""] * 5 for _ in range(max_order)]
+    for day, order, name in slots:
+        grid[order - 1][day - 1] = name
+    return grid
+
+
+def create_grid(collection, table_data):
+    """Bulk insert the courses and schedules of a new collection's grid,
+    returns the created schedule ids"""
+    slots = parse_grid(table_data)
+    courses = Course.objects.bulk_create(
+        Course(collection=collection, name=name) for name in slots
+    )
+    schedules = Schedule.objects.bulk_create(
+        Schedule(course=course, day_of_week=day, order=order)
+        for course in courses
+        for day, order in sorted(slots[course.name])
+    )
+    return [schedule.id for schedule in schedules]
+
+
+def apply_grid(collection, table_data):
+    """Bring the collection's courses and schedules in line with a courses_data
+    grid with the fewest writes, returns (created schedule ids, removed
+    (course_id, day_of_week) slots)"""
+    wanted = parse_grid(table_data)
+
+    courses, duplicates = {}, []
+    for course in collection.courses.order_by("id"):
+        if course.name in courses:
+            duplicates.append(course.id)
+        else:
+            courses[course.name] = course
+    current = defaultdict(dict)
+    course_names = {course.id: name for name, course in courses.items()}
+    for schedule in Schedule.objects.filter(course_id__in=course_names):
+        current[course_names[schedule.course_id]][
+            schedule.day_of_week, schedule.order
+        ] = schedule
+
+    # A course whose slots are unchanged but whose name is new was renamed,
+    # keep it so its attendance history survives
+    removed = {name for name in courses if name not in wanted}
+    added = {name for name in wanted if name not in courses}
+    renamed = []
+    for old_name in sorted(removed):
+        matches = [
+            name for name in added if wanted[name] == set(current[old_name].keys())
+        ]
+        if len(matches) == 1:
+            course = courses.pop(old_name)
+            course.name = matches[0]
+            courses[course.name] = course
+            current[course.name] = current.pop(old_name)
+            removed.discard(old_name)
+            added.discard(course.name)
+            renamed.append(course)
+    Course.objects.bulk_update(renamed, ["name"])
+
+    duplicates += [courses.pop(name).id for name in removed]
+    Course.objects.filter(id__in=duplicates).delete()
+    new_courses = Course.objects.bulk_create(
+        Course(collection=collection, name=name) for name in sorted(added)
+    )
+    courses.update({course.name: course for course in new_courses})
+
+    reordered, new_schedules, deleted, removed_slots = [], [], [], set()
+    for name, course in courses.items():
+        existing = current.get(name, {})
+        stale = [slot for slot in existing if slot not in wanted[name]]
+        missing = sorted(slot for slot in wanted[name] if slot not in existing)
+
+        # Moving a period within the same day leaves that day's sessions as they are
+        for slot in missing:
+            same_day = next((old for old in stale if old[0] == slot[0]), None)
+            if same_day is not None:
+                stale.remove(same_day)
+                schedule = existing[same_day]
+                schedule.order = slot[1]
+                reordered.append(schedule)
+            else:
+                new_schedules.append(
+                    Schedule(course=course, day_of_week=slot[0], order=slot[1])
+                )
+        for slot in stale:
+            deleted.append(existing[slot].id)
+            removed_slots.add((course.id, slot[0]))
+
+    Schedule.objects.bulk_update(reordered, ["order"])
+    Schedule.objects.filter(id__in=deleted).delete()
+    created = Schedule.objects.bulk_create(new_schedules)
+    return [schedule.id for schedule in created], removed_slots
+
+
+def _copy_rows(model, course_map, columns, select=None, params=()):
+    """INSERT ... SELECT the rows of the mapped courses, pointing the copies at
+    the new course ids, returns the number of rows copied"""
+    if not course_map:
+        return 0
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    course_id = quote("course_id")
+    select = select or ", ".join(quote(column) for column in columns)
+    new_course_id = (
+        f"CASE {course_id} "
+        + " ".join("WHEN %s THEN %s" for _ in course_map)
+        + " END"
+    )
+    sql = (
+        f"INSERT INTO {table} ({course_id}, {', '.join(quote(c) for c in columns)}) "
+        f"SELECT {new_course_id}, {select} FROM {table} "
+        f"WHERE {course_id} IN ({', '.join(['%s'] * len(course_map))})"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            sql,
+            [id for pair in course_map.items() for id in pair]
+            + list(params)
+            + list(course_map),
+        )
+        return cursor.rowcount
+
+
+def clone_collection(template, user):
+    """Copy a shared collection for a new owner along with its courses,
+    schedules, holidays and session skeleton, returns the copy and the number
+    of sessions copied"""
+    with transaction.atomic():
+        collection = Collection.objects.create(
+            user=user,
+            name=template.name,
+            threshold=template.threshold,
+            start_date=template.start_date,
+            end_date=template.end_date,
+            generated_until=template.generated_until,
+        )
+        courses = list(template.courses.order_by("id"))
+        copies = Course.objects.bulk_create(
+            Course(collection=collection, name=course.name) for course in courses
+        )
+        course_map = {old.id: new.id for old, new in zip(courses, copies)}
+
+        Holiday.objects.bulk_create(
+            Holiday(collection=collection, date=date, name=name)
+            for date, name in template.holidays.values_list("date", "name")
+        )
+        _copy_rows(Schedule, course_map, ["day_of_week", "order"])
+        # Bunks are personal, cancellations apply to the whole class
+        date, period, status = map(connection.ops.quote_name, ["date", "period", "status"])
+        copied = _copy_rows(
+            Session,
+            course_map,
+            ["date", "period", "status"],
+            select=f"{date}, {period}, CASE WHEN {status} = %s THEN %s ELSE {status} END",
+            params=["bunked", "present"],
+        )
+        # Raw inserts bypass SessionQuerySet, so the counters and change log
+        # entries are written here
+        AttendanceCounter.objects.rebuild(course_map.values())
+        for model in (Schedule, Session):
+            ChangeLog.objects.record(
+                model.objects.filter(course_id__in=course_map.values())
+            )
+        Marketplace.objects.adopted(template)
+    return collection, copied
@@ -20,11 +20,13 @@ modelpatterns = [
     path("schedules", views.ScheduleListView.as_view(), name="schedule-list"),
     path("schedule/<int:pk>", views.ScheduleView.as_view(), name="schedule-detail"),
     path("sessions", views.SessionView.as_view(), name="session-list"),
+    path("sessions/batch", views.BatchAttendance.as_view(), name="session-batch"),
     path("session/<int:pk>", views.SessionView.as_view(), name="session-detail"),
     path("schedule_selector", views.ScheduleSelector.as_view()),
     path("courses", views.CourseView.as_view(), name="course-list"),
     path("user_details", views.UserDetail.as_view(), name="user-detail"),
     path("bulk_cancel", views.BulkCancelSessions.as_view()),
+    path("export/<str:fmt>", views.ExportView.as_view(), name="export"),
 ]
 
 querypatterns = [
@@ -32,8 +34,13 @@ querypatterns = [
         "datequery",
         views.DateQuery.as_view(),
     ),
+    path("calendar", views.CalendarQuery.as_view()),
     path("statquery", views.StatQuery.as_view()),
     path("current", views.CurrentStatQuery.as_view()),
+    path("sync", views.SyncView.as_view()),
+    path("generation_status", views.GenerationStatus.as_view()),
+    path("cache_stats", views.CacheStats.as_view()),
+    path("metrics", views.MetricsView.as_view()),
 ]
 
 urlpatterns = list(userpatterns + modelpatterns + querypatterns)
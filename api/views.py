@@ -1,12 +1,19 @@
 import datetime
+import hashlib
 from collections import defaultdict
 
-from django.contrib.auth import login
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
-from django.db.models import F, Max
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
 from rest_framework import generics, permissions, status
 from rest_framework.authtoken.models import Token
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from rest_framework.views import APIView
@@ -14,19 +21,33 @@ from rest_framework.authtoken.serializers import AuthTokenSerializer
 
 from knox.views import LoginView, LogoutView
 
-from api.models import Collection, Course, Schedule, Session
+from api import metrics, stats, sync
+from api.async_views import AsyncViewMixin
+from api.auth import cache_token
+from api.cache import InvalidateCacheMixin, cache_response, get_stats
+from api.exports import CONTENT_TYPES, EXPORTERS
+from api.generation import trim_sessions
+from api.models import Collection, Course, Marketplace, Schedule, Session
 from api.serializers import (
     CollectionSerializer,
     CollectionViewSerializer,
     CourseSerializer,
     DateQuerySerializer,
+    MarketplaceSerializer,
     ScheduleSerializer,
+    SessionChangeSerializer,
     SessionSerializer,
     StatQuerySerializer,
     CurrentStatSerializer,
     UserSerializer,
 )
-from tasks.celery import create_sessions, create_sessions_schedule
+from api.timetable import abuild_grid, build_grid, clone_collection
+from tasks.celery import (
+    await_generation,
+    generation_state,
+    request_sessions,
+    wait_for_generation,
+)
 
 
 class UserList(generics.ListAPIView):
@@ -56,11 +77,18 @@ class UserLogin(LoginView):
         data = self.get_post_response_data(request, token, instance)
         return Response(data, status=202)
 
+    def create_token(self):
+        instance, token = super().create_token()
+        # The client uses the token right away, skip the first cache miss
+        cache_token(instance)
+        return instance, token
+
     def post(self, request, format=None):
         serializer = AuthTokenSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.validated_data["user"]
-        login(request, user)
+        # Clients only ever send the token, a django session would be written
+        # to the cache and never read
+        request.user = serializer.validated_data["user"]
         return super().post(request, format=None)
 
 
@@ -69,7 +97,12 @@ class UserLogout(LogoutView):
         return Response({"bye-bye": request.user.username}, status=200)
 
 
-class CollectionView(generics.RetrieveUpdateDestroyAPIView, generics.CreateAPIView):
+class CollectionView(
+    AsyncViewMixin,
+    InvalidateCacheMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+    generics.CreateAPIView,
+):
     permissions = [permissions.IsAuthenticated]
     serializer_class = CollectionSerializer
     queryset = Collection.objects.all()
@@ -95,31 +128,30 @@ class CollectionView(generics.RetrieveUpdateDestroyAPIView, generics.CreateAPIVi
 
         return Response(serializer.data)
 
+    @cache_response("collection")
     def get(self, request):
         instance = get_object_or_404(Collection, user=self.request.user)
         serializer = self.get_serializer(instance)
 
-        schedules = Schedule.objects.filter(course__collection__user=request.user)
-        max_order = schedules.aggregate(Max("order", default=1))["order__max"]
-        # First nested list is the first period of each day, second nested list is second period of each day
-        template = [[""] * 5 for i in range(max_order)]
+        result = dict(serializer.data)
+        result["courses_data"] = build_grid(instance)
+        return Response(result, status=status.HTTP_200_OK)
 
-        for day in range(0, 5):
-            schedules_on_day = schedules.filter(day_of_week=day + 1).order_by("order")
-            for schedule in schedules_on_day:
-                template[schedule.order - 1][
-                    schedule.day_of_week - 1
-                ] = schedule.course.name
+    @cache_response("collection")
+    async def aget(self, request):
+        instance = await aget_object_or_404(Collection, user=self.request.user)
+        serializer = self.get_serializer(instance)
 
         result = dict(serializer.data)
-        result["courses_data"] = template
+        result["courses_data"] = await abuild_grid(instance)
         return Response(result, status=status.HTTP_200_OK)
 
 
-class CourseView(generics.CreateAPIView):
+class CourseView(InvalidateCacheMixin, generics.CreateAPIView):
     permissions = [permissions.IsAuthenticated]
     serializer_class = CourseSerializer
 
+    @cache_response("courses")
     def get(self, request):
         result = []
 
@@ -151,7 +183,7 @@ class CourseView(generics.CreateAPIView):
         return Response(result, status=status.HTTP_201_CREATED)
 
 
-class ScheduleCreateView(generics.ListCreateAPIView):
+class ScheduleCreateView(InvalidateCacheMixin, generics.ListCreateAPIView):
     permissions = [permissions.IsAuthenticated]
     serializer_class = ScheduleSerializer
     lookup_field = "course_id"
@@ -166,37 +198,56 @@ class ScheduleCreateView(generics.ListCreateAPIView):
         id = self.kwargs.get("course_id")
         course = get_object_or_404(Course, id=id)
         schedule = serializer.save(course=course)
-        create_sessions_schedule.delay(
-            schedule.id, course.collection.start_date, course.collection.end_date
-        )
+        request_sessions(course.collection_id, schedule_ids=[schedule.id])
 
 
-class ScheduleView(generics.RetrieveDestroyAPIView):
+class ScheduleView(InvalidateCacheMixin, generics.RetrieveDestroyAPIView):
     permissions = [permissions.IsAuthenticated]
     serializer_class = ScheduleSerializer
 
     def get_queryset(self):
         collection = get_object_or_404(Collection, user=self.request.user)
-        return Schedule.objects.filter(course__collection=collection)
+        return (
+            Schedule.objects.filter(course__collection=collection)
+            .select_related("course__collection")
+            .annotate(course_schedules=Count("course__schedules"))
+        )
 
     def perform_destroy(self, instance):
-        day = instance.day_of_week
         course = instance.course
-        Session.objects.filter(date__week_day=day + 1, course=course).delete()
-        if course.schedules.count() == 1:
-            course.delete()
-            return
-        instance.delete()
-
-
-class ScheduleListView(APIView):
+        with transaction.atomic():
+            if instance.course_schedules == 1:
+                course.delete()
+                if course.collection.shared:
+                    Marketplace.objects.sync(course.collection)
+                return
+            instance.delete()
+            # Only this slot's upcoming sessions go, marked attendance stays
+            trim_sessions([(course.id, instance.day_of_week)])
+
+
+class ScheduleListView(AsyncViewMixin, APIView):
     permissions = [permissions.IsAuthenticated]
 
+    def get_schedules(self, collection):
+        return (
+            Schedule.objects.filter(course__collection=collection)
+            .select_related("course")
+            .order_by(F("day_of_week"))
+        )
+
+    @cache_response("schedules")
     def get(self, request):
         collection = get_object_or_404(Collection, user=self.request.user)
-        schedules = Schedule.objects.filter(course__collection=collection).order_by(
-            F("day_of_week")
-        )
+        return self.render_schedules(request, self.get_schedules(collection))
+
+    @cache_response("schedules")
+    async def aget(self, request):
+        collection = await aget_object_or_404(Collection, user=self.request.user)
+        schedules = [schedule async for schedule in self.get_schedules(collection)]
+        return self.render_schedules(request, schedules)
+
+    def render_schedules(self, request, schedules):
         result = defaultdict(list)
         for schedule in schedules:
             result[schedule.get_day_of_week_display()].append(
@@ -212,7 +263,7 @@ class ScheduleListView(APIView):
         return Response(result, status=status.HTTP_200_OK)
 
 
-class ScheduleSelector(generics.CreateAPIView):
+class ScheduleSelector(InvalidateCacheMixin, generics.CreateAPIView):
     permissions = [permissions.IsAuthenticated]
     serializer_class = ScheduleSerializer
 
@@ -227,7 +278,11 @@ class ScheduleSelector(generics.CreateAPIView):
             Session.objects.create(course=schedule.course, date=date, status="present")
 
 
-class SessionView(generics.RetrieveUpdateDestroyAPIView, generics.CreateAPIView):
+class SessionView(
+    InvalidateCacheMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+    generics.CreateAPIView,
+):
     permissions = [permissions.IsAuthenticated]
     serializer_class = SessionSerializer
 
@@ -240,77 +295,183 @@ class SessionView(generics.RetrieveUpdateDestroyAPIView, generics.CreateAPIView)
         serializer.save(status=status)
 
 
-class DateQuery(APIView):
+class DateQuery(AsyncViewMixin, APIView):
     permissions = [permissions.IsAuthenticated]
 
-    def get(self, request):
-        date_str = request.GET.get("date")
+    def get_courses(self, collection):
+        date_str = self.request.GET.get("date")
         date = datetime.date.fromisoformat(date_str)
-        collection = get_object_or_404(Collection, user=self.request.user)
 
         courses = Course.objects.filter(sessions__date=date, collection=collection)
         # Add session status to each course
         courses = courses.annotate(status=F("sessions__status"))
         # Add session id to each course, used for building url
-        courses = courses.annotate(s_id=F("sessions__id"))
+        return courses.annotate(s_id=F("sessions__id"))
 
+    @cache_response("datequery")
+    def get(self, request):
+        collection = get_object_or_404(Collection, user=self.request.user)
+        serializer = DateQuerySerializer(
+            self.get_courses(collection), many=True, context={"request": request}
+        )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @cache_response("datequery")
+    async def aget(self, request):
+        collection = await aget_object_or_404(Collection, user=self.request.user)
         serializer = DateQuerySerializer(
-            courses, many=True, context={"request": request}
+            [course async for course in self.get_courses(collection)],
+            many=True,
+            context={"request": request},
         )
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
-class StatQuery(generics.ListAPIView):
+class CalendarQuery(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    max_days = 93
+
+    def get(self, request):
+        try:
+            start = datetime.date.fromisoformat(request.GET.get("start", ""))
+            end = datetime.date.fromisoformat(request.GET.get("end", ""))
+        except ValueError:
+            return Response(
+                {"error": "start and end are required, use YYYY-MM-DD."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not start <= end < start + datetime.timedelta(days=self.max_days):
+            return Response(
+                {"error": f"end must be within {self.max_days} days after start."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        rows = list(
+            Session.objects.filter(
+                course__collection__user=request.user, date__gte=start, date__lte=end
+            )
+            .order_by("date", "course_id", "id")
+            .values_list("id", "date", "status", "course__name", "updated_at")
+        )
+
+        # Deleted sessions dont move Last-Modified, the ETag covers them
+        etag = '"%s"' % hashlib.sha1(
+            repr([row[:4] for row in rows]).encode()
+        ).hexdigest()
+        last_modified = max((row[4] for row in rows), default=None)
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified and int(last_modified.timestamp()),
+        )
+        if response is None:
+            # Every session url shares the prefix, reverse it once
+            session_url = reverse(
+                "session-detail", kwargs={"pk": 0}, request=request
+            ).removesuffix("0")
+            days = {
+                (start + datetime.timedelta(days=offset)).isoformat(): []
+                for offset in range((end - start).days + 1)
+            }
+            for id, date, session_status, name, _ in rows:
+                days[date.isoformat()].append(
+                    {
+                        "name": name,
+                        "status": session_status,
+                        "session_url": f"{session_url}{id}",
+                    }
+                )
+            response = Response(
+                {"start": start, "end": end, "days": days}, status=status.HTTP_200_OK
+            )
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class StatQuery(AsyncViewMixin, generics.ListAPIView):
     permissions = [permissions.IsAuthenticated]
     serializer_class = StatQuerySerializer
 
     def get_queryset(self):
         collection = get_object_or_404(Collection, user=self.request.user)
-        return Course.objects.filter(collection=collection)
+        return stats.with_stats(Course.objects.filter(collection=collection))
 
+    async def alist(self, request):
+        collection = await aget_object_or_404(Collection, user=self.request.user)
+        courses = await stats.awith_stats(Course.objects.filter(collection=collection))
+        serializer = self.get_serializer(
+            [course async for course in courses], many=True
+        )
+        return Response(serializer.data)
 
-class CurrentStatQuery(generics.ListAPIView):
-    permissions = [permissions.IsAuthenticated]
+    @cache_response("statquery")
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+    @cache_response("statquery")
+    async def aget(self, request, *args, **kwargs):
+        return await self.alist(request)
+
+
+class CurrentStatQuery(StatQuery):
     serializer_class = CurrentStatSerializer
 
-    def get_queryset(self):
-        collection = get_object_or_404(Collection, user=self.request.user)
-        return Course.objects.filter(collection=collection)
+    @cache_response("current")
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
+
+    @cache_response("current")
+    async def aget(self, request, *args, **kwargs):
+        return await self.alist(request)
+
+
+class MarketplacePagination(CursorPagination):
+    ordering = "-id"
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
 
 
 class CollectionList(generics.ListAPIView):
     permissions = [permissions.IsAuthenticated]
-    serializer_class = CollectionViewSerializer
+    serializer_class = MarketplaceSerializer
+    pagination_class = MarketplacePagination
 
     def get_queryset(self):
-        return Collection.objects.filter(shared=True)
+        listings = Marketplace.objects.all()
+        prefix = self.request.GET.get("prefix")
+        if prefix:
+            listings = listings.filter(search_name__startswith=prefix.lower())
+        search = self.request.GET.get("search")
+        if search:
+            listings = listings.search(search)
+        return listings
 
 
-class CollectionSelector(generics.CreateAPIView):
+class CollectionSelector(InvalidateCacheMixin, generics.CreateAPIView):
     permissions = [permissions.IsAuthenticated]
     serializer_class = CollectionViewSerializer
 
     def perform_create(self, serializer):
         copy_id = serializer.validated_data.pop("copy_id")
-        collection = get_object_or_404(Collection, id=copy_id)
+        # Only templates their owners shared, the copy carries their sessions
+        collection = get_object_or_404(Collection, id=copy_id, shared=True)
 
-        # If User has a collection, delete it
-        my_collection = Collection.objects.filter(user=self.request.user)
-        if my_collection:
-            my_collection.delete()
-
-        cloned_collection = collection.make_clone(
-            attrs={"shared": False, "user": self.request.user}
-        )
-        create_sessions.delay(
-            cloned_collection.id,
-            cloned_collection.start_date,
-            cloned_collection.end_date,
-        )
+        with transaction.atomic():
+            # If User has a collection, delete it
+            Collection.objects.filter(user=self.request.user).delete()
+            cloned_collection, copied = clone_collection(collection, self.request.user)
 
+        # Templates whose sessions have not been generated yet are filled in
+        # the background like a new collection
+        if not copied:
+            request_sessions(cloned_collection.id, bulk=True)
 
 
-class BulkCancelSessions(APIView):
+class BulkCancelSessions(InvalidateCacheMixin, APIView):
     permissions = [permissions.IsAuthenticated]
 
     def post(self, request):
@@ -352,3 +513,216 @@ class BulkCancelSessions(APIView):
             status=status.HTTP_200_OK,
         )
 
+
+class BatchAttendance(InvalidateCacheMixin, APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    max_changes = 500
+
+    def post(self, request):
+        changes = request.data.get("changes") if isinstance(request.data, dict) else None
+        if not isinstance(changes, list) or not changes:
+            return Response(
+                {"error": "changes must be a non empty list."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(changes) > self.max_changes:
+            return Response(
+                {"error": f"At most {self.max_changes} changes can be sent at once."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        results, valid = [], []
+        for index, change in enumerate(changes):
+            serializer = SessionChangeSerializer(data=change)
+            if serializer.is_valid():
+                results.append({"index": index})
+                valid.append((index, serializer.validated_data))
+            else:
+                results.append(
+                    {"index": index, "result": "invalid", "errors": serializer.errors}
+                )
+
+        collection = get_object_or_404(Collection, user=request.user)
+        session_ids = {data["session_id"] for _, data in valid if "session_id" in data}
+        slots = {
+            (data["course"], data["date"])
+            for _, data in valid
+            if "session_id" not in data
+        }
+
+        # Ownership of the whole batch is checked by this one query, sessions
+        # of other users simply arent found
+        lookup = Q(id__in=session_ids)
+        if slots:
+            lookup |= Q(
+                course_id__in={course for course, _ in slots},
+                date__in={date for _, date in slots},
+            )
+        by_id, by_slot = {}, defaultdict(list)
+        for session in Session.objects.filter(
+            lookup, course__collection=collection
+        ).only("id", "course_id", "date", "status"):
+            by_id[session.id] = session
+            by_slot[session.course_id, session.date].append(session)
+
+        changed = {}
+        for index, data in valid:
+            if "session_id" in data:
+                sessions = [by_id[data["session_id"]]] if data["session_id"] in by_id else []
+            else:
+                sessions = by_slot.get((data["course"], data["date"]), [])
+            if not sessions:
+                results[index]["result"] = "not_found"
+                continue
+            # Later changes to the same session win, like sequential PATCHes
+            for session in sessions:
+                session.status = data["status"]
+                changed[session.id] = session
+            results[index]["result"] = "ok"
+            results[index]["sessions"] = [session.id for session in sessions]
+
+        # bulk_update runs a single CASE update through SessionQuerySet.update,
+        # which keeps the attendance counters in sync
+        with transaction.atomic():
+            Session.objects.bulk_update(changed.values(), ["status"])
+
+        return Response(
+            {"updated_count": len(changed), "results": results},
+            status=status.HTTP_200_OK,
+        )
+
+
+class SyncView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        since = request.GET.get("since")
+        if since is None:
+            return Response(sync.snapshot(request.user), status=status.HTTP_200_OK)
+        try:
+            since = int(since)
+        except ValueError:
+            return Response(
+                {"error": "since must be a cursor returned by an earlier sync."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            sync.changes_since(request.user, since), status=status.HTTP_200_OK
+        )
+
+
+class GenerationStatus(AsyncViewMixin, APIView):
+    """Lets clients wait for their sessions instead of polling the read
+    endpoints until they fill up. With ?wait=<seconds> the request is held
+    until generation is done, at most max_wait seconds. A sync wait holds a
+    worker thread, so it is capped at a few seconds and clients ask again,
+    the async handler waits on the event loop"""
+
+    permission_classes = [permissions.IsAuthenticated]
+    max_wait = 30
+    max_sync_wait = 5
+    counts = {"courses": Count("id", distinct=True), "sessions": Count("sessions")}
+
+    def requested_wait(self, request, max_wait):
+        try:
+            return min(int(request.GET.get("wait", 0)), max_wait)
+        except ValueError:
+            return None
+
+    def status_response(self, collection, state, counts):
+        if state is None:
+            # Requests are only tracked with a redis cache, a collection whose
+            # range was never generated still has sessions on the way
+            state = "done" if collection.generated_until else "pending"
+        response = Response(
+            {
+                "status": state,
+                "start_date": collection.start_date,
+                "end_date": collection.end_date,
+                "generated_until": collection.generated_until,
+                **counts,
+            },
+            status=status.HTTP_200_OK,
+        )
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def invalid_wait(self):
+        return Response(
+            {"error": "wait must be a number of seconds."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    def get(self, request):
+        wait = self.requested_wait(request, self.max_sync_wait)
+        if wait is None:
+            return self.invalid_wait()
+        collection = get_object_or_404(Collection, user=self.request.user)
+        if wait > 0:
+            state = wait_for_generation(collection.id, wait)
+            collection.refresh_from_db(fields=["generated_until"])
+        else:
+            state = generation_state(collection.id)
+        counts = Course.objects.filter(collection=collection).aggregate(**self.counts)
+        return self.status_response(collection, state, counts)
+
+    async def aget(self, request):
+        wait = self.requested_wait(request, self.max_wait)
+        if wait is None:
+            return self.invalid_wait()
+        collection = await aget_object_or_404(Collection, user=self.request.user)
+        if wait > 0:
+            state = await await_generation(collection.id, wait)
+            await collection.arefresh_from_db(fields=["generated_until"])
+        else:
+            state = await sync_to_async(generation_state)(collection.id)
+        counts = await Course.objects.filter(collection=collection).aaggregate(
+            **self.counts
+        )
+        return self.status_response(collection, state, counts)
+
+
+class CacheStats(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_stats(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """Prometheus scrape target, for staff users or a Bearer METRICS token"""
+
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        token = metrics.get_settings()["TOKEN"]
+        if not (
+            request.user.is_staff
+            or token
+            and constant_time_compare(
+                request.headers.get("Authorization", ""), f"Bearer {token}"
+            )
+        ):
+            return Response(
+                {"error": "Metrics are only available to staff or with the token."},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
+
+
+class ExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, fmt):
+        if fmt not in EXPORTERS:
+            return Response(
+                {"error": f"Unsupported format, use one of {', '.join(EXPORTERS)}."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        collection = get_object_or_404(Collection, user=self.request.user)
+        response = StreamingHttpResponse(
+            EXPORTERS[fmt](Collection.objects.filter(id=collection.id)),
+            content_type=CONTENT_TYPES[fmt],
+        )
+        response["Content-Disposition"] = f'attachment; filename="timetable.{fmt}"'
+        return response
@@ -26,6 +26,8 @@ DATABASES = {
         "HOST": os.environ.get("DBHOST"),
         "USER": os.environ.get("DBUSER"),
         "PASSWORD": os.environ.get("DBPASS"),
+        "CONN_MAX_AGE": int(os.environ.get("DBCONNMAXAGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import datetime
 import os
 from pathlib import Path
 
@@ -49,12 +50,24 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "knox.auth.TokenAuthentication",
+        "api.auth.CachedTokenAuthentication",
     ]
 }
 
+# Tokens never expire unless TOKEN_TTL_HOURS is set, expired ones are
+# deleted by the purge_expired_tokens beat job
 REST_KNOX = {
-    "TOKEN_TTL": None,
+    "TOKEN_TTL": (
+        datetime.timedelta(hours=int(os.environ["TOKEN_TTL_HOURS"]))
+        if os.environ.get("TOKEN_TTL_HOURS")
+        else None
+    ),
+}
+
+# Verified tokens are cached for TIMEOUT seconds, see api/auth.py
+AUTH_CACHE = {
+    "ENABLED": os.environ.get("AUTH_CACHE_ENABLED", "true") == "true",
+    "TIMEOUT": int(os.environ.get("AUTH_CACHE_TIMEOUT", 60 * 60)),
 }
 
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
@@ -69,6 +82,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "api.middleware.QueryMetricsMiddleware",
 ]
 
 ROOT_URLCONF = "core.urls"
@@ -91,6 +105,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "core.wsgi.application"
 
+# The read endpoints have async handlers, see api/async_views.py. They only
+# pay off under ASGI, under WSGI every async view would start an event loop
+ASYNC_VIEWS = os.environ.get("WEB_SERVER") == "uvicorn"
+
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -102,6 +120,10 @@ DATABASES = {
         "USER": os.environ.get("DBUSER"),
         "PASSWORD": os.environ.get("DBPASS"),
         "PORT": os.environ.get("DBPORT"),
+        # Reuse connections across requests, checked before reuse so a
+        # restarted database does not fail the first request
+        "CONN_MAX_AGE": int(os.environ.get("DBCONNMAXAGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
@@ -118,6 +140,28 @@ CACHES = {
 
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 
+# Per user cache of the read endpoints, see api/cache.py
+RESPONSE_CACHE = {
+    "ENABLED": os.environ.get("RESPONSE_CACHE_ENABLED", "true") == "true",
+    "TIMEOUT": int(os.environ.get("RESPONSE_CACHE_TIMEOUT", 60 * 60)),
+}
+
+# Per view query counts and timings, see api/middleware.py. Requests over
+# QUERY_THRESHOLD queries are logged, /metrics accepts "Bearer <TOKEN>"
+METRICS = {
+    "ENABLED": os.environ.get("METRICS_ENABLED", "true") == "true",
+    "QUERY_THRESHOLD": int(os.environ.get("METRICS_QUERY_THRESHOLD", 20)),
+    "TOKEN": os.environ.get("METRICS_TOKEN") or None,
+}
+
+# Sessions are materialized WINDOW_WEEKS ahead by the roll_sessions beat
+# job, unset generates each collection's whole range up front. PARTITIONS
+# is the number of tasks the daily run is split into, see tasks/celery.py
+SESSION_GENERATION = {
+    "WINDOW_WEEKS": int(os.environ.get("SESSION_WINDOW_WEEKS") or 0) or None,
+    "PARTITIONS": int(os.environ.get("SESSION_GENERATION_PARTITIONS", 4)),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
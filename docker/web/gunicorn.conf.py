@@ -0,0 +1,35 @@
+# Gunicorn settings for the web container, every value can be tuned from the env
+# https://docs.gunicorn.org/en/stable/settings.html
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS") or multiprocessing.cpu_count() * 2 + 1)
+# gthread workers serve several requests per process while others wait on the
+# database, threads are ignored by the uvicorn workers of WEB_SERVER=uvicorn
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Import django once in the master so forked workers start warm and share memory.
+# A HUP only forks new workers from the already loaded code, so code changes
+# need a restart of the container
+preload_app = True
+# Recycle workers now and then to bound memory growth, the jitter keeps them
+# from all restarting at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+# Time in flight requests get to finish on SIGTERM
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading must not be shared with the workers
+    from django.db import connections
+
+    connections.close_all()
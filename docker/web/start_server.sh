@@ -1,6 +1,22 @@
 #!/bin/sh
-echo "Running Migrations"
-python manage.py migrate
+# Migrations run once in the migrate service of docker-compose.yml, before
+# any web or celery container starts
 
-echo "Starting Server"
-python manage.py runserver 0.0.0.0:8000
+if [ "$WEB_SERVER" = "runserver" ]; then
+    echo "Starting development server"
+    exec python manage.py runserver 0.0.0.0:8000
+fi
+
+# gunicorn finishes in flight requests on SIGTERM, so restarting the container
+# is the graceful way to pick up new code
+if [ "$WEB_SERVER" = "uvicorn" ]; then
+    # Every request runs its ORM calls in a fresh thread under ASGI, so
+    # persistent connections would pile up rather than be reused
+    export DBCONNMAXAGE=0
+    echo "Starting gunicorn with uvicorn workers"
+    exec gunicorn --config docker/web/gunicorn.conf.py \
+        --worker-class uvicorn.workers.UvicornWorker core.asgi:application
+fi
+
+echo "Starting gunicorn"
+exec gunicorn --config docker/web/gunicorn.conf.py core.wsgi:application
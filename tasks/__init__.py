@@ -1,3 +1,31 @@
-from .celery import create_sessions, create_sessions_schedule, debug
+from .celery import (
+    await_generation,
+    create_sessions,
+    create_sessions_schedule,
+    debug,
+    generate_pending_sessions,
+    generation_state,
+    purge_changelog,
+    purge_expired_tokens,
+    purge_task_results,
+    request_sessions,
+    roll_sessions,
+    roll_sessions_partition,
+    wait_for_generation,
+)
 
-__all__ = ["create_sessions", "create_sessions_schedule", "debug"]
+__all__ = [
+    "await_generation",
+    "create_sessions",
+    "create_sessions_schedule",
+    "debug",
+    "generate_pending_sessions",
+    "generation_state",
+    "purge_changelog",
+    "purge_expired_tokens",
+    "purge_task_results",
+    "request_sessions",
+    "roll_sessions",
+    "roll_sessions_partition",
+    "wait_for_generation",
+]
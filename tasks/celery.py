@@ -1,8 +1,12 @@
+import datetime
 import logging
 import os
+import time
+import uuid
 
 import django
 from celery import Celery
+from celery.schedules import crontab
 
 if os.environ.get("PRODUCTION") == "true":
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.production")
@@ -14,56 +18,387 @@ else:
 
 django.setup()
 
+# Redis serves priority 0 first. Interactive edits go ahead of bulk work
+# such as filling in a cloned collection
+INTERACTIVE_PRIORITY = 0
+BULK_PRIORITY = 6
+# A generation request waits at most this long in the queue before another
+# one for the same collection is queued regardless, in case it was lost
+QUEUED_TIMEOUT = 15 * 60
+# A collection whose generation ran out of retries is reported as failed
+# until it is requested again, at most this long
+FAILED_TIMEOUT = 24 * 60 * 60
+PURGE_BATCH_SIZE = 10000
+
+# Task results are only stored when RESULT_BACKEND is set, e.g. to a redis
+# url, and expire after RESULT_EXPIRES seconds there
+result_backend = os.getenv("RESULT_BACKEND") or None
+
 app = Celery("tasks")
 app.conf.timezone = "Asia/Kolkata"
 app.conf.broker_url = broker_url
-app.conf.result_backend = "django-db"
+app.conf.result_backend = result_backend
+app.conf.result_expires = int(os.getenv("RESULT_EXPIRES", 24 * 60 * 60))
+# Nothing reads the return values by default, failures are reported to sentry
+app.conf.task_ignore_result = result_backend is None
+app.conf.task_routes = {
+    "tasks.celery.create_sessions*": {"queue": "sessions"},
+    "tasks.celery.generate_pending_sessions": {"queue": "sessions"},
+    "tasks.celery.roll_sessions*": {"queue": "maintenance"},
+    "tasks.celery.purge_expired_tokens": {"queue": "maintenance"},
+    "tasks.celery.purge_task_results": {"queue": "maintenance"},
+    "tasks.celery.purge_changelog": {"queue": "maintenance"},
+}
+app.conf.task_default_priority = 3
+# Queues are drained in the order the worker lists them, sessions first
+app.conf.broker_transport_options = {"queue_order_strategy": "priority"}
+# Prefetched messages would be run ahead of more urgent ones queued later
+app.conf.worker_prefetch_multiplier = 1
+app.conf.beat_schedule = {
+    "roll-sessions": {
+        "task": "tasks.celery.roll_sessions",
+        "schedule": crontab(hour=0, minute=30),
+    },
+    "purge-expired-tokens": {
+        "task": "tasks.celery.purge_expired_tokens",
+        "schedule": crontab(hour=1, minute=0),
+    },
+    "purge-task-results": {
+        "task": "tasks.celery.purge_task_results",
+        "schedule": crontab(hour=1, minute=30),
+    },
+    "purge-changelog": {
+        "task": "tasks.celery.purge_changelog",
+        "schedule": crontab(hour=2, minute=0),
+    },
+}
+
+
+def _redis():
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _pending_key(collection_id):
+    return f"sessions:pending:{collection_id}"
+
+
+def _queued_key(collection_id):
+    return f"sessions:queued:{collection_id}"
+
+
+def _running_key(collection_id):
+    return f"sessions:running:{collection_id}"
+
+
+def _failed_key(collection_id):
+    return f"sessions:failed:{collection_id}"
+
+
+def _finished_channel(collection_id):
+    return f"sessions:finished:{collection_id}"
+
+
+def _redis_url():
+    """Location of the redis cache, None for other backends"""
+    from django.conf import settings
+
+    cache = settings.CACHES["default"]
+    if cache["BACKEND"] != "django_redis.cache.RedisCache":
+        return None
+    location = cache["LOCATION"]
+    return location[0] if isinstance(location, (list, tuple)) else location
+
+
+def _state(running, pending, failed):
+    if running:
+        return "running"
+    if pending:
+        return "pending"
+    return "failed" if failed else "done"
+
+
+def _state_pipeline(client, collection_id):
+    pipeline = client.pipeline(transaction=False)
+    pipeline.exists(_running_key(collection_id))
+    pipeline.exists(_queued_key(collection_id), _pending_key(collection_id))
+    pipeline.exists(_failed_key(collection_id))
+    return pipeline
+
+
+def generation_state(collection_id):
+    """The collection's generation state: running while its sessions are
+    being generated, pending while requests for it wait in the queue, failed
+    when its last run gave up retrying and done otherwise. None without a
+    redis cache, requests are not tracked then"""
+    client = _redis()
+    if client is None:
+        return None
+    return _state(*_state_pipeline(client, collection_id).execute())
+
+
+def wait_for_generation(collection_id, timeout):
+    """Block until the collection's generation is done or failed, at most
+    timeout seconds, and return its state"""
+    client = _redis()
+    if client is None:
+        return None
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    # Subscribed before the first check so a run finishing in between is seen
+    pubsub.subscribe(_finished_channel(collection_id))
+    try:
+        deadline = time.monotonic() + timeout
+        while (state := generation_state(collection_id)) not in ("done", "failed"):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Checked again every few seconds in case a run died silently and
+            # its running key expired
+            pubsub.get_message(timeout=min(remaining, 5))
+        return state
+    finally:
+        pubsub.close()
+
+
+async def await_generation(collection_id, timeout):
+    """wait_for_generation for async views, waits on the event loop over a
+    connection of its own instead of holding a thread"""
+    from redis import asyncio as aioredis
+
+    url = _redis_url()
+    if url is None:
+        return None
+    client = aioredis.from_url(url)
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(_finished_channel(collection_id))
+        deadline = time.monotonic() + timeout
+        while True:
+            state = _state(*await _state_pipeline(client, collection_id).execute())
+            remaining = deadline - time.monotonic()
+            if state in ("done", "failed") or remaining <= 0:
+                return state
+            await pubsub.get_message(timeout=min(remaining, 5))
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def request_sessions(collection_id, schedule_ids=None, bulk=False, whole_range=None):
+    """Queue the generation of a collection's sessions. New schedules, given
+    as schedule_ids, are generated after today only. With whole_range, the
+    default without schedule_ids, every other schedule is generated over the
+    collection's dates. Requests for a collection that already has a
+    generation waiting in the queue are merged into it, so a burst of edits
+    costs one run over their union"""
+    if whole_range is None:
+        whole_range = schedule_ids is None
+    schedule_ids = list(schedule_ids or [])
+    if not whole_range and not schedule_ids:
+        return
+    priority = BULK_PRIORITY if bulk else INTERACTIVE_PRIORITY
+    client = _redis()
+    if client is None:
+        # Without redis nothing is merged, every request is queued
+        generate_pending_sessions.apply_async(
+            (collection_id, schedule_ids, whole_range), priority=priority
+        )
+        return
 
+    pipeline = client.pipeline()
+    pipeline.sadd(
+        _pending_key(collection_id), *schedule_ids, *(["all"] if whole_range else [])
+    )
+    pipeline.delete(_failed_key(collection_id))
+    pipeline.set(_queued_key(collection_id), priority, nx=True, ex=QUEUED_TIMEOUT)
+    pipeline.get(_queued_key(collection_id))
+    _, _, queued, queued_priority = pipeline.execute()
+    # An interactive request does not wait behind a queued bulk run
+    if queued or int(queued_priority) > priority:
+        client.set(_queued_key(collection_id), priority, ex=QUEUED_TIMEOUT)
+        generate_pending_sessions.apply_async((collection_id,), priority=priority)
 
+
+@app.task(bind=True, max_retries=3, default_retry_delay=30)
+def generate_pending_sessions(self, collection_id, schedule_ids=None, whole_range=None):
+    """Generate the sessions requested through request_sessions since the
+    last run, over the collection's current dates"""
+    from api.cache import bump_collection_generation
+    from api.generation import generate_requested
+
+    if whole_range is None:
+        whole_range = schedule_ids is None
+    schedule_ids = schedule_ids or []
+    client = _redis()
+    # The running key holds the ids of the runs in progress, so overlapping
+    # runs only report the collection done once the last of them finishes
+    run_id = self.request.id or uuid.uuid4().hex
+    if client is not None:
+
+        def claim(pipeline):
+            pending = pipeline.smembers(_pending_key(collection_id))
+            # Requests made from here on queue a new run
+            pipeline.multi()
+            pipeline.delete(_queued_key(collection_id), _pending_key(collection_id))
+            if pending:
+                pipeline.sadd(_running_key(collection_id), run_id)
+                pipeline.expire(_running_key(collection_id), QUEUED_TIMEOUT)
+            return pending
+
+        # Retried if a request adds to the pending set in between
+        pending = client.transaction(
+            claim, _pending_key(collection_id), value_from_callable=True
+        )
+        if not pending:
+            return "Nothing to generate, merged into an earlier run"
+        pending = {member.decode() for member in pending}
+        whole_range = "all" in pending
+        schedule_ids = sorted(int(id) for id in pending - {"all"})
+
+    try:
+        inserted = generate_requested(collection_id, schedule_ids, whole_range)
+        if inserted is None:
+            return "Collection was deleted"
+        # Before the run is marked done, so clients polling the status never
+        # read a cached response from before it
+        bump_collection_generation(collection_id)
+        if client is not None:
+            client.delete(_failed_key(collection_id))
+    except Exception as exc:
+        if client is None:
+            raise self.retry(exc=exc)
+        if self.request.retries >= self.max_retries:
+            # Nothing will pick the requests up again, the status reports
+            # failed instead of pending until the next request
+            client.set(_failed_key(collection_id), 1, ex=FAILED_TIMEOUT)
+            raise
+        client.sadd(
+            _pending_key(collection_id),
+            *schedule_ids,
+            *(["all"] if whole_range else []),
+        )
+        raise self.retry(exc=exc)
+    finally:
+        if client is not None:
+            pipeline = client.pipeline()
+            pipeline.srem(_running_key(collection_id), run_id)
+            pipeline.exists(_running_key(collection_id))
+            _, running = pipeline.execute()
+            if not running:
+                client.publish(_finished_channel(collection_id), 1)
+    return f"Inserted {inserted} sessions into the database"
+
+
+# Kept only so messages queued before generation requests were merged are
+# still consumed, remove once a release has drained the sessions queue
 @app.task
-def create_sessions(collection_id, start_date, end_date):
-    """Create sessions for all schedules"""
-    from api.dateutils import working_days
-    from api.models import Schedule, Session
-
-    schedules = Schedule.objects.filter(course__collection__id=collection_id)
-    session_objs = []
-    for day in working_days(start_date, end_date):
-        for schedule in schedules:
-            if (
-                schedule.day_of_week - 1
-            ) == day.weekday():  # python weekday starts at 0
-                session_objs.append(
-                    Session(date=day, course=schedule.course, status="present")
-                )
-                logging.info(
-                    f"added session for {schedule.course.name} on date {day.strftime('%Y-%m-%d')}"
-                )
-
-    Session.objects.bulk_create(session_objs)
-    return f"Inserted {len(session_objs)} sessions into the database"
+def create_sessions(collection_id, start_date, end_date, schedule_ids=None):
+    """Deprecated, queues request_sessions for the collection"""
+    request_sessions(collection_id, schedule_ids=schedule_ids)
+    return "Requested a session generation"
 
 
 @app.task
 def create_sessions_schedule(schedule_id, start_date, end_date):
-    """Create sessions for one schedule"""
-    from api.dateutils import working_days
-    from api.models import Schedule, Session
-
-    schedule = Schedule.objects.get(id=schedule_id)
-
-    session_objs = []
-    for day in working_days(start_date, end_date):
-        if (schedule.day_of_week - 1) == day.weekday():
-            session_objs.append(
-                Session(date=day, course=schedule.course, status="present")
-            )
-            logging.info(
-                f"added session for {schedule.course.name} on date {day.strftime('%Y-%m-%d')}"
-            )
-
-    Session.objects.bulk_create(session_objs)
-    return f"Inserted {len(session_objs)} sessions into the database"
+    """Deprecated, queues request_sessions for the schedule"""
+    from api.models import Schedule
+
+    collection_id = (
+        Schedule.objects.filter(id=schedule_id)
+        .values_list("course__collection_id", flat=True)
+        .first()
+    )
+    if collection_id is None:
+        return "Schedule was deleted"
+    request_sessions(collection_id, schedule_ids=[schedule_id])
+    return "Requested a session generation"
+
+
+@app.task
+def roll_sessions():
+    """Split the daily window advance into partitions so workers share it"""
+    from django.conf import settings
+
+    partitions = settings.SESSION_GENERATION["PARTITIONS"]
+    for partition in range(partitions):
+        roll_sessions_partition.delay(partition, partitions)
+
+
+@app.task
+def roll_sessions_partition(partition, partitions):
+    """Advance the sessions of every due collection with id % partitions == partition"""
+    from api.cache import bump_collection_generation
+    from api.generation import due_collections, roll_sessions
+
+    inserted = 0
+    for collection in due_collections(partition, partitions).iterator():
+        added = roll_sessions(collection)
+        if added:
+            bump_collection_generation(collection.id)
+        inserted += added
+    return f"Inserted {inserted} sessions into the database"
+
+
+@app.task
+def purge_expired_tokens():
+    """Delete the auth tokens past their expiry, dropping their cache entries"""
+    from django.utils import timezone
+    from knox.models import AuthToken
+
+    # Importing api.auth connects the receiver that revokes cached tokens
+    import api.auth  # noqa: F401
+
+    deleted, _ = AuthToken.objects.filter(expiry__lt=timezone.now()).delete()
+    return f"Deleted {deleted} expired tokens"
+
+
+@app.task
+def purge_task_results():
+    """Delete task results stored in the database past the retention, in
+    batches so the table is never locked for long"""
+    from django.utils import timezone
+    from django_celery_results.models import TaskResult
+
+    retention = datetime.timedelta(
+        days=int(os.getenv("TASK_RESULT_RETENTION_DAYS", 7))
+    )
+    expired = TaskResult.objects.filter(date_done__lt=timezone.now() - retention)
+    deleted = 0
+    while ids := list(expired.values_list("id", flat=True)[:PURGE_BATCH_SIZE]):
+        deleted += TaskResult.objects.filter(id__in=ids).delete()[0]
+    return f"Deleted {deleted} task results"
+
+
+@app.task
+def purge_changelog():
+    """Delete the change log entries past the retention, in batches. Clients
+    whose sync cursor was purged get a full snapshot on their next sync"""
+    from django.utils import timezone
+
+    from api.models import ChangeLog
+
+    retention = datetime.timedelta(
+        days=int(os.getenv("CHANGELOG_RETENTION_DAYS", 30))
+    )
+    # Ids grow with created_at, so everything up to the newest expired entry
+    # goes, deleted by primary key ranges
+    last_id = (
+        ChangeLog.objects.filter(created_at__lt=timezone.now() - retention)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    if last_id is None:
+        return "Deleted 0 change log entries"
+    expired = ChangeLog.objects.filter(id__lte=last_id).order_by("id")
+    deleted = 0
+    while ids := list(expired.values_list("id", flat=True)[:PURGE_BATCH_SIZE]):
+        deleted += ChangeLog.objects.filter(id__in=ids).delete()[0]
+    return f"Deleted {deleted} change log entries"
 
 
 @app.task